@@ -1,88 +1,96 @@
 import os
 import subprocess
+import numpy as np
 import streamlit as st
-import re
-from pyvis.network import Network
-import pandas as pd
-import textwrap
+import time
+
+from graph_index import build_graph_index, load_graph_index
+from graph_layout import get_layout, node_coordinates
+from jobs import ACTIVE_STATUSES, get_job_manager
+from manifest import compute_delta, mark_indexed, plan_update, promote_update_output, save_uploads
+from project_registry import get_project_registry
+from query_cache import get_query_cache
+from query_broker import get_query_broker
+from query_engine import format_response
+from query_graph import MAX_EDGES, MAX_NODES, generate_query_visulization
+from tracing import load_traces, span, summarize, trace, write_traces
 
 st.set_page_config(page_title="GraphRAG UI Webpage", layout="wide")
 
+# how many recent query traces the latency summary is computed over
+TRACE_SUMMARY_WINDOW = 500
+
+# rows per page in the project and uploaded file lists
+PROJECTS_PER_PAGE = 20
+FILES_PER_PAGE = 20
+
 if 'working_directory' not in st.session_state:
     st.session_state.working_directory = ''
 
-def filter_query_output(output):
-    start_marker = "SUCCESS:"
-    try:
-        response = output.split(start_marker, 1)[1]
-        return f"SUCCESS:{response.strip()}"
-    except ValueError:
-        return ""
-
-# Fetch names of all projects
-def get_project_names():
-    projects_path = os.path.join(os.getcwd(), 'projects')
-    if os.path.exists(projects_path):
-        return sorted([name for name in os.listdir(projects_path) if os.path.isdir(os.path.join(projects_path, name))])
-    return []
-
-def display_uploaded_files(input_dir):
-    if os.path.exists(input_dir):
-        files = os.listdir(input_dir)
-        if files:
-            st.markdown("##### Uploaded Files")
-            for file in files:
-                file_path = os.path.join(input_dir, file)
-                col_file, col_delete = st.columns([3, 1])
-                with col_file:
-                    st.write(file)
-                with col_delete:
-                    if st.button("Delete", key=f"delete_{file}"):
-                        try:
-                            os.remove(file_path)
-                            st.success(f"Deleted {file}")
-                        except Exception as e:
-                            st.error(f"Error deleting {file}: {e}")
-        else:
-            st.write("No files uploaded.")
-    else:
+def page_offset(total, page_size, key):
+    # page picker for a long list, returns the offset of the first row to show
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    return (page - 1) * page_size
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+def display_uploaded_files(working_directory):
+    # one page of input/ at a time, the listing itself is cached by the project registry
+    registry = get_project_registry()
+    st.markdown("##### Uploaded Files")
+    search = st.text_input("Search uploaded files", key="file_search")
+    _, total = registry.input_files(working_directory, search, 0, 0)
+    if not total:
         st.write("No files uploaded.")
+        return
+    offset = page_offset(total, FILES_PER_PAGE, "file_page")
+    files, _ = registry.input_files(working_directory, search, offset, FILES_PER_PAGE)
+    st.caption(f"Showing {offset + 1}-{offset + len(files)} of {total} files")
+    for file, size in files:
+        file_path = os.path.join(working_directory, 'input', file)
+        col_file, col_size, col_delete = st.columns([3, 1, 1])
+        with col_file:
+            st.write(file)
+        with col_size:
+            st.write(format_size(size))
+        with col_delete:
+            if st.button("Delete", key=f"delete_{file}"):
+                try:
+                    os.remove(file_path)
+                    st.success(f"Deleted {file}")
+                except Exception as e:
+                    st.error(f"Error deleting {file}: {e}")
 
-def extract_entities_and_relations(filtered_result):
-    entities_pattern = r"Entities\s*\((.*?)\)"
-    relationships_pattern = r"Relationships\s*\((.*?)\)"
-
-    entities = []
-    relations = []
-
-    # Find all matched "Entities" and "Relationships" data
-    entities_matches = re.findall(entities_pattern, filtered_result)
-    relationships_matches = re.findall(relationships_pattern, filtered_result)
-
-    # Handle matched Entities
-    for match in entities_matches:
-        items = match.split(',')
-        for item in items:
-            item = item.strip()
-            if item.startswith('+'):
-                break
-            try:
-                entities.append(int(item))
-            except ValueError:
-                continue
-
-    # Handle matched Relations
-    for match in relationships_matches:
-        items = match.split(',')
-        for item in items:
-            item = item.strip()
-            if item.startswith('+'):
-                break
-            relations.append(item)
-
-    return entities, relations
-
-def generate_cypher_query(entities, relations):
+def index_finished(working_directory, snapshot):
+    # runs on the job thread once graphrag exits cleanly. The graph index and its layout are derived
+    # caches that load_graph_index and node_coordinates build on first use, so failing to prebuild
+    # them doesn't fail the index job
+    mark_indexed(working_directory, snapshot)
+    try:
+        build_graph_index(working_directory)
+    except Exception as e:
+        print(f"Graph index for {working_directory} not prebuilt, it is built on first use: {e}")
+        return
+    try:
+        get_layout(load_graph_index(working_directory))
+    except Exception as e:
+        print(f"Graph layout for {working_directory} not precomputed, it is computed on first render: {e}")
+
+def generate_cypher_query(context_data):
+    # ids of the entity and relationship records the answer was built from
+    context_data = context_data or {}
+    entities = [record["id"] for record in context_data.get("entities") or []]
+    relations = [record["id"] for record in context_data.get("relationships") or []]
     entities_str = ", ".join(map(str, entities))
     relations_str = ", ".join(f'"{rel}"' for rel in relations)
 
@@ -99,64 +107,69 @@ def generate_cypher_query(entities, relations):
     """
     return cypher_query
 
-def generate_query_visulization(entities_ids, relations_ids, working_directory):
-    GRAPHRAG_FOLDER = os.path.join(working_directory, "output")
-    entity_df = pd.read_parquet(
-        f"{GRAPHRAG_FOLDER}/create_final_entities.parquet",
-        columns=["name", "type", "description", "human_readable_id", "id"]
-    )
-    rel_df = pd.read_parquet(
-        f"{GRAPHRAG_FOLDER}/create_final_relationships.parquet",
-        columns=["source", "target", "description", "human_readable_id"]
-    )
-
-    filtered_entities = entity_df[entity_df["human_readable_id"].isin(entities_ids)]
-    filtered_relations = rel_df[rel_df["human_readable_id"].isin(relations_ids)]
-
-    net = Network(height="750px", width="100%", directed=True)
-
-    # record added nodes
-    added_nodes = set()
-
-    for _, row in filtered_entities.iterrows():
-        node_id = row['human_readable_id']
-        # limit 50 words per line
-        description_wrapped = "\n".join(textwrap.wrap(row['description'], width=50))
-        net.add_node(
-            node_id,
-            label=row['name'],  # show name in circle node
-            title=f"Name: {row['name']}\nType: {row['type']}\nDescription: {description_wrapped}",  # show info
-            group=row['type']
-        )
-        added_nodes.add(node_id)
-
-    for _, row in filtered_relations.iterrows():
-        if row['source'] not in added_nodes:
-            net.add_node(row['source'], label=row['source'], title=f"{row['source']}")
-            added_nodes.add(row['source'])
-
-        if row['target'] not in added_nodes:
-            net.add_node(row['target'], label=row['target'], title=f"{row['target']}")
-            added_nodes.add(row['target'])
-
-        description_wrapped = "\n".join(textwrap.wrap(row['description'], width=50))
-        net.add_edge(
-            row['source'], row['target'],
-            title=f"{description_wrapped}",
-            # label="relation"
-        )
-
-    net.write_html("filtered_graph_visualization.html")
+def render_query_graph(working_directory, context_data, max_nodes, max_edges):
+    # answer graph plus any neighborhoods or paths picked below it, looked up in the graph index
+    cited = [record["entity"] for record in (context_data or {}).get("entities") or []]
+    graph_index = load_graph_index(working_directory)
+    expansion = None
+    if graph_index is not None and cited:
+        with st.expander("Explore Neighborhood"):
+            expand = st.multiselect("Expand entities", cited, key="expand_entities")
+            col_hops, col_degree = st.columns(2)
+            hops = col_hops.number_input("Hops", min_value=1, max_value=3, value=1, key="expand_hops")
+            max_neighbors = col_degree.number_input("Max neighbors per entity", min_value=1, value=20, key="expand_degree")
+            col_from, col_to = st.columns(2)
+            path_from = col_from.selectbox("Shortest path from", [""] + cited, key="path_from")
+            path_to = col_to.text_input("to entity", key="path_to").strip()
+
+            positions, edge_rows = [], []
+            if expand:
+                with span("graph_expand"):
+                    nodes, edges = graph_index.k_hop(graph_index.positions_of(expand), hops, max_neighbors, max_nodes)
+                positions.append(nodes)
+                edge_rows.append(edges)
+            if path_from and path_to:
+                ends = graph_index.positions_of([path_from, path_to])
+                with span("graph_path"):
+                    path = graph_index.shortest_path(ends[0], ends[1]) if len(ends) == 2 else None
+                if path is None:
+                    st.info(f"No path from {path_from} to {path_to} within 6 hops.")
+                else:
+                    positions.append(path[0])
+                    edge_rows.append(path[1])
+                    st.write(" -> ".join(graph_index.node_table()["name"].iloc[path[0]]))
+            if positions:
+                expansion = graph_index.records(np.concatenate(positions), np.concatenate(edge_rows))
+
+    # html is built in memory per request, so concurrent sessions never share a file
+    # node positions come from the project layout, so the browser renders without a physics simulation
+    coordinates = None
+    if graph_index is not None:
+        coordinates = lambda names: node_coordinates(graph_index, names)
+    html_content, truncated = generate_query_visulization(context_data, max_nodes, max_edges, expansion, coordinates)
+    if truncated:
+        st.info(f"Graph limited to {max_nodes} nodes and {max_edges} edges.")
+    st.components.v1.html(html_content, height=750, width=1200, scrolling=True)
+
+    with span("generate_cypher_query"):
+        cypher_query = generate_cypher_query(context_data)
+    with st.expander("Cypher Query"):
+        st.code(cypher_query, language="cypher")  # automatic copy
 
 st.title("GraphRAG UI Webpage")
 
 page = st.sidebar.selectbox("Navigate", ["Project Initialization", "Indexing", "Query"])
 
-project_names = get_project_names()
-selected_project = st.sidebar.selectbox("Select Project", [""] + project_names)
+registry = get_project_registry()
+selected_project = st.sidebar.selectbox("Select Project", [""] + registry.project_names())
 
 if selected_project:
-    st.session_state.working_directory = os.path.join(os.getcwd(), 'projects', selected_project)
+    st.session_state.working_directory = registry.project_dir(selected_project)
+    project_info = registry.info(selected_project)
+    st.sidebar.caption(
+        f"{project_info['status']}, {project_info['input_files']} input files "
+        f"({format_size(project_info['input_bytes'])}), last indexed {format_time(project_info['last_indexed'])}"
+    )
 else:
     st.session_state.working_directory = ''
 
@@ -193,8 +206,6 @@ if page == "Project Initialization":
         else:
             st.warning("Please enter a project name.")
 
-    existing_projects = get_project_names()
-
     # sidebar
     # st.sidebar.title("GraphRAG UI Webpage")
     # selected_project = st.sidebar.selectbox("Select Project", [""] + existing_projects)
@@ -205,10 +216,23 @@ if page == "Project Initialization":
     # Existing Projects Section
     st.subheader("Existing Projects")
 
-    if existing_projects:
+    search = st.text_input("Search projects", key="project_search")
+    _, total = registry.search_projects(search, 0, 0)
+    if total:
         with st.expander("Show Existing Projects"):
-            for project in existing_projects:
-                st.write(f"- {project}")
+            offset = page_offset(total, PROJECTS_PER_PAGE, "project_page")
+            projects, _ = registry.search_projects(search, offset, PROJECTS_PER_PAGE)
+            st.dataframe([
+                {
+                    "Project": info["name"],
+                    "Status": info["status"],
+                    "Input files": info["input_files"],
+                    "Input size": format_size(info["input_bytes"]),
+                    "Last indexed": format_time(info["last_indexed"]),
+                    "Artifacts": len(info["artifacts"]),
+                }
+                for info in projects
+            ], hide_index=True)
     else:
         st.write("No existing projects found.")
 
@@ -234,13 +258,11 @@ elif page == "Indexing":
             uploaded_files = st.file_uploader("Upload TXT files", type=["txt"], accept_multiple_files=True)
             if uploaded_files:
                 input_dir = os.path.join(working_directory, 'input')
-                os.makedirs(input_dir, exist_ok=True)
-                for uploaded_file in uploaded_files:
-                    file_path = os.path.join(input_dir, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                st.success(f"Uploaded {len(uploaded_files)} file(s) to {input_dir}")
-                display_uploaded_files(input_dir)
+                saved, skipped = save_uploads(working_directory, uploaded_files)
+                st.success(f"Uploaded {len(saved)} file(s) to {input_dir}")
+                if skipped:
+                    st.info(f"Skipped {len(skipped)} file(s) already present: {', '.join(skipped)}")
+                display_uploaded_files(working_directory)
 
             # 2. Language Selection
             st.markdown("##### Language")
@@ -263,30 +285,23 @@ elif page == "Indexing":
                         st.warning("Please enter a Domain.")
                     else:
                         try:
-                            cmd = [
-                                "graphrag", "prompt-tune",
-                                "--root", working_directory,
-                                "--domain", domain,
-                                "--chunk-size", str(chunk_size)
-                            ]
-                            subprocess.run(cmd, check=True)
-                            st.success("Prompt Tuning Success!")
-                        except subprocess.CalledProcessError as e:
-                            st.error(f"An error occurred during Prompt Tuning: {e}")
+                            get_job_manager().submit(
+                                "prompt-tune", working_directory, domain=domain, chunk_size=chunk_size
+                            )
+                            st.success("Prompt Tuning started in the background.")
                         except Exception as e:
                             st.error(f"Unexpected error: {e}")
 
             with col_index:
                 if st.button("Start Indexing"):
                     try:
-                        cmd = [
-                            "graphrag", "index",
-                            "--root", working_directory
-                        ]
-                        subprocess.run(cmd, check=True)
-                        st.success("Indexing Successfully!")
-                    except subprocess.CalledProcessError as e:
-                        st.error(f"An error occurred during Indexing: {e}")
+                        # record what was indexed so later updates only process the delta
+                        snapshot = compute_delta(working_directory)["snapshot"]
+                        get_job_manager().submit(
+                            "index", working_directory,
+                            on_success=lambda job, wd=working_directory, snap=snapshot: index_finished(wd, snap),
+                        )
+                        st.success("Indexing started in the background.")
                     except Exception as e:
                         st.error(f"Unexpected error: {e}")
 
@@ -298,28 +313,67 @@ elif page == "Indexing":
             incremental_files = st.file_uploader("Upload TXT files for Incremental Indexing", type=["txt"], accept_multiple_files=True, key="incremental_upload")
             if incremental_files:
                 input_dir = os.path.join(working_directory, 'input')
-                os.makedirs(input_dir, exist_ok=True)
-                for uploaded_file in incremental_files:
-                    file_path = os.path.join(input_dir, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                st.success(f"Uploaded {len(incremental_files)} file(s) to {input_dir}")
+                saved, skipped = save_uploads(working_directory, incremental_files)
+                st.success(f"Uploaded {len(saved)} file(s) to {input_dir}")
+                if skipped:
+                    st.info(f"Skipped {len(skipped)} file(s) already present: {', '.join(skipped)}")
+
+            delta = compute_delta(working_directory)
+            st.markdown(
+                f"##### Changes since last index\n"
+                f"{len(delta['added'])} added, {len(delta['changed'])} changed, {len(delta['removed'])} removed"
+            )
 
             # # 2. Update Files Button
             # st.markdown("### 2. Actions")
             if st.button("Update Files"):
                 try:
-                    cmd = [
-                        "update",
-                        "--root", working_directory
-                    ]
-                    subprocess.run(cmd, check=True)
-                    st.success("Updating Successfully!")
-                except subprocess.CalledProcessError as e:
-                    st.error(f"An error occurred during Updating: {e}")
+                    kind = plan_update(delta)
+                    snapshot = delta["snapshot"]
+                    if kind is None:
+                        st.info("Index is already up to date.")
+                    elif kind == "update":
+                        def on_update_success(job, working_directory=working_directory, snapshot=snapshot):
+                            promote_update_output(working_directory)
+                            index_finished(working_directory, snapshot)
+
+                        get_job_manager().submit("update", working_directory, on_success=on_update_success)
+                        st.success(f"Updating {len(delta['added'])} new file(s) in the background.")
+                    else:
+                        get_job_manager().submit(
+                            "index", working_directory,
+                            on_success=lambda job, wd=working_directory, snap=snapshot: index_finished(wd, snap),
+                        )
+                        st.warning("Changed or removed files need a full re-index, which started in the background.")
                 except Exception as e:
                     st.error(f"Unexpected error: {e}")
 
+    # Background jobs for this project, state is read back from disk on every rerun
+    st.subheader("Jobs")
+    job_manager = get_job_manager()
+    project_jobs = job_manager.list_jobs(working_directory)
+    if not project_jobs:
+        st.write("No jobs yet.")
+    for job in project_jobs[:10]:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["created"]))
+        with st.expander(f"{job['kind']} - {job['status']} - {started}", expanded=job["status"] in ACTIVE_STATUSES):
+            if job["status"] in ACTIVE_STATUSES:
+                stage = job["stage"] or "starting"
+                st.progress(job["progress"], text=f"{stage} ({job['progress']:.0%})")
+                if st.button("Cancel", key=f"cancel_{job['id']}"):
+                    job_manager.cancel(working_directory, job["id"])
+                    st.rerun()
+            if job["error"]:
+                st.error(job["error"])
+            st.code(job_manager.read_log(job) or "(no output yet)")
+
+    if any(job["status"] in ACTIVE_STATUSES for job in project_jobs):
+        if st.checkbox("Auto refresh", value=True):
+            time.sleep(2)
+            st.rerun()
+        elif st.button("Refresh"):
+            st.rerun()
+
 elif page == "Query":
     if not st.session_state.working_directory:
         st.warning("Please select a project from the sidebar first.")
@@ -331,43 +385,110 @@ elif page == "Query":
 
     query_mode = st.selectbox("Query Mode", ["local", "global", "drift"])
 
-    if st.button("Start Query"):
+    stream_response = st.checkbox("Stream response", value=True)
+    bypass_cache = st.checkbox("Bypass answer cache", value=False)
+
+    with st.expander("Graph Settings"):
+        max_nodes = st.number_input("Max nodes", min_value=1, step=50, value=MAX_NODES)
+        max_edges = st.number_input("Max edges", min_value=1, step=50, value=MAX_EDGES)
+
+    col_start, col_cancel = st.columns([1, 1])
+    with col_start:
+        start_query = st.button("Start Query")
+    with col_cancel:
+        # clicking reruns the script, which interrupts the page that is rendering the stream
+        if st.button("Cancel Query"):
+            active_query = st.session_state.get("active_query")
+            if active_query is not None and not active_query.done():
+                active_query.cancel()
+                st.warning("Query cancelled.")
+            st.session_state.active_query = None
+
+    if start_query:
         if question:
             working_directory = st.session_state.working_directory
 
             query_status = st.info(f"Running query with {query_mode} mode. Please wait...")
 
             try:
-                command = [
-                    "graphrag", "query", 
-                    "--root", working_directory, 
-                    "--method", query_mode, 
-                    "--query", question,
-                ]
-                result = subprocess.run(command, capture_output=True, text=True, check=True)
-
-                filtered_result = filter_query_output(result.stdout)
-                enttities, relations = extract_entities_and_relations(filtered_result)
-                cypher_query = generate_cypher_query(enttities, relations)
-
                 st.markdown("### Response:")
-                with st.expander("Show Response", expanded=True):
-                    st.text_area("Query Response", filtered_result, height=600)
-                query_status.empty()
-                st.success("Response Generated Successfully!")
-
-                generate_query_visulization(enttities, relations, working_directory)
-                # display html content
-                with open("filtered_graph_visualization.html", "r", encoding="utf-8") as f:
-                    html_content = f.read()
-                st.components.v1.html(html_content, height=750, width=1200, scrolling=True)
-
-                with st.expander("Cypher Query"):
-                    st.code(cypher_query, language="cypher")  # automatic copy
+                with trace("query", question=question, method=query_mode, root=working_directory) as query_trace:
+                    query_cache = get_query_cache()
+                    with span("cache_lookup") as attrs:
+                        cached = None if bypass_cache else query_cache.get(working_directory, query_mode, question)
+                        attrs["hit"] = cached is not None
+                    if cached is not None:
+                        response, context_data = cached
+                        filtered_result = format_response(query_mode, response)
+                        with st.expander("Show Response (cached)", expanded=True):
+                            st.text_area("Query Response", filtered_result, height=600)
+                        query_status.empty()
+                    else:
+                        # one broker serves every session: identical questions in flight run once and
+                        # at most MAX_CONCURRENT_QUERIES searches run at a time, the rest wait in line
+                        broker = get_query_broker()
+                        ticket = broker.submit(working_directory, query_mode, question)
+                        st.session_state.active_query = ticket
+                        with span("queue_wait") as attrs:
+                            attrs["coalesced"] = ticket.coalesced
+                            position = ticket.position()
+                            while position > 0:
+                                query_status.info(
+                                    f"Waiting for a free query slot: position {position} of {broker.queue_length()} in the queue..."
+                                )
+                                time.sleep(0.5)
+                                position = ticket.position()
+                        if ticket.coalesced:
+                            st.caption("An identical query was already running, its answer is shared.")
+                        if stream_response:
+                            with st.expander("Show Response", expanded=True):
+                                query_status.empty()
+                                response = st.write_stream(ticket)
+                        else:
+                            query_status.info(f"Running query with {query_mode} mode. Please wait...")
+                            response = "".join(ticket)
+                        st.session_state.active_query = None
+                        if ticket.cancelled:
+                            st.warning("Query cancelled.")
+                            st.stop()
+                        context_data = ticket.context_data
+                        filtered_result = format_response(query_mode, response)
+                        if not stream_response:
+                            with st.expander("Show Response", expanded=True):
+                                st.text_area("Query Response", filtered_result, height=600)
+                            query_status.empty()
+
+                    # kept so the neighborhood controls can redraw the graph on later reruns
+                    st.session_state.query_result = {
+                        "working_directory": working_directory,
+                        "response": filtered_result,
+                        "context_data": context_data,
+                    }
+                    st.success("Response Generated Successfully!")
+                    render_query_graph(working_directory, context_data, max_nodes, max_edges)
+
+                write_traces([query_trace])
+                with st.expander("Latency"):
+                    st.markdown(f"This query took {query_trace.duration_ms / 1000:.2f}s")
+                    st.dataframe(query_trace.to_record()["spans"])
+                    recent = [
+                        record for record in load_traces(limit=TRACE_SUMMARY_WINDOW)
+                        if record["attrs"].get("root") == working_directory
+                    ]
+                    st.markdown(f"Per-stage latency over the last {len(recent)} queries of this project")
+                    st.dataframe(summarize(recent))
 
-            except subprocess.CalledProcessError as e:
-                st.error(f"An error occurred: {e}")
             except Exception as e:
                 st.error(f"Unexpected error: {e}")
         else:
             st.warning("Please input a question before starting the query.")
+    else:
+        query_result = st.session_state.get("query_result")
+        if query_result is not None and query_result["working_directory"] == working_directory:
+            st.markdown("### Response:")
+            with st.expander("Show Response", expanded=True):
+                st.text_area("Query Response", query_result["response"], height=600)
+            try:
+                render_query_graph(working_directory, query_result["context_data"], max_nodes, max_edges)
+            except Exception as e:
+                st.error(f"Unexpected error: {e}")
@@ -1,135 +1,438 @@
-import re
+import argparse
+import asyncio
+import hashlib
 import json
-from openai import OpenAI
-import jsonlines
+import os
+import random
+import re
 import time
 
-def batch_eval(query_file, result1_file, result2_file, output_file_path):
-    # Openai configuration
-    client = OpenAI(api_key='',base_url = "")
+import jsonlines
+import openai
+from openai import AsyncOpenAI
+
+from dataset_io import is_parquet, load_columns
+from sharding import collect, parse_shard, select_shard, shard_path, shard_paths
+from token_usage import BudgetExceeded, UsageTracker, count_message_tokens, format_preflight, preflight, truncate_text
+
+# judge call settings
+MODEL = "gpt-4o"
+MAX_TOKENS = 1500
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# provider limits the limiter is sized to
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
+CONCURRENCY = 16
+
+
+class TokenBucketLimiter:
+    # Two token buckets refilled continuously: one for requests, one for tokens per minute.
+    # acquire() waits until both have room for the call.
+
+    def __init__(self, rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        # a single call larger than the bucket would never fit, cap it at the bucket size
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm,
+                    (tokens - self._tokens) * 60 / self.tpm,
+                )
+                await asyncio.sleep(max(wait, 0.01))
+
+
+def build_messages(query, answer1, answer2):
+    sys_prompt = """
+    ---Role---
+    You are an expert tasked with evaluating two answers to the same question based on five criteria: **Accuracy**, **Comprehensiveness**, **Diversity**, **Empowerment**, and **Hallucination**.
+    """
+
+    prompt = f"""
+    You will evaluate two answers to the same question based on five criteria: **Accuracy**, **Comprehensiveness**, **Diversity**, **Empowerment**, and **Hallucination**.
+
+    - **Accuracy**: How correct and factual is the information provided in the answer?
+    - **Comprehensiveness**: How much detail does the answer provide to cover all aspects and details of the question?
+    - **Diversity**: How varied and rich is the answer in providing different perspectives and insights on the question?
+    - **Empowerment**: How well does the answer help the reader understand and make informed judgments about the topic?
+    - **Hallucination**: How free is the answer from fabricated or unsupported information?
+
+    For each criterion, choose the better answer (either Answer 1 or Answer 2) and explain why. Then, select an overall winner based on these five categories.
+
+    Here is the question:
+    {query}
+
+    Here are the two answers:
+
+    **Answer 1:**
+    {answer1}
+
+    **Answer 2:**
+    {answer2}
+
+    Evaluate both answers using the five criteria listed above and provide detailed explanations for each criterion.
+
+    Output your evaluation in the following JSON format, do not contain the "json" identifier at the beginning and end!!!:
+
+    {{
+        "Accuracy": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Provide explanation here]"
+        }},
+        "Comprehensiveness": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Provide explanation here]"
+        }},
+        "Diversity": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Provide explanation here]"
+        }},
+        "Empowerment": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Provide explanation here]"
+        }},
+        "Hallucination": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Provide explanation here]"
+        }},
+        "Overall Winner": {{
+            "Winner": "[Answer 1 or Answer 2]",
+            "Explanation": "[Summarize why this answer is the overall winner based on the five criteria]"
+        }}
+    }}
+
+    The output should not contain any extra characters or text outside of this JSON structure.
+    Do NOT contain the "json" identifier at the beginning and end.
+    """
+
+    return [
+        {"role": "system", "content": sys_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def parse_evaluation(text):
+    # tolerate a ```json fence even though the prompt asks for bare JSON
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    return json.loads(text)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+async def judge(client, limiter, messages, model=MODEL, max_tokens=MAX_TOKENS, max_retries=MAX_RETRIES,
+                usage=None, labels=None):
+    # re-issues the request on 429/5xx/connection errors and on replies that are not valid JSON;
+    # usage (a UsageTracker) records every billed attempt and enforces its budget before each one
+    prompt_tokens = count_message_tokens(messages, model)
+    for attempt in range(max_retries):
+        await limiter.acquire(prompt_tokens + max_tokens)
+        reserved = await usage.reserve(prompt_tokens, max_tokens) if usage is not None else 0.0
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=max_tokens,
+            )
+            if usage is not None:
+                usage.record(response.usage, prompt_tokens, labels)
+            return parse_evaluation(response.choices[0].message.content)
+        except Exception as e:
+            retryable = isinstance(e, json.JSONDecodeError) or _is_retryable(e)
+            if not retryable or attempt == max_retries - 1:
+                raise
+            delay = _retry_after(e) or min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        finally:
+            if usage is not None:
+                await usage.release(reserved)
+
+
+async def abatch_eval(items, client, limiter, concurrency=CONCURRENCY, model=MODEL, max_tokens=MAX_TOKENS,
+                      done=None, on_result=None, indices=None, usage=None, labels=None):
+    # items are (query, answer1, answer2); results come back in the same order, None for failures.
+    # done maps index -> evaluation already judged; on_result(index, evaluation) fires as each finishes;
+    # indices limits the run to those items (a shard), the rest stay None; usage and the per-item
+    # labels (e.g. {"systems": [...]}) go to judge() for token accounting
+    semaphore = asyncio.Semaphore(concurrency)
+    done = done or {}
+    results = [done.get(i) for i in range(len(items))]
+
+    async def worker(index, query, answer1, answer2):
+        async with semaphore:
+            try:
+                results[index] = await judge(
+                    client, limiter, build_messages(query, answer1, answer2), model, max_tokens,
+                    usage=usage, labels={"index": index, **(labels[index] if labels else {})},
+                )
+                print(f"Successfully evaluate {index + 1}/{len(items)}")
+            except BudgetExceeded as e:
+                print(f"Skipped {index + 1}/{len(items)}: {e}")
+                return
+            except Exception as e:
+                print(f"Failed to evaluate {index + 1}/{len(items)} after retries: {e}")
+                return
+        if on_result is not None:
+            on_result(index, results[index])
+
+    indices = range(len(items)) if indices is None else indices
+    pending = [(i, *items[i]) for i in indices if i not in done]
+    await asyncio.gather(*(worker(*item) for item in pending))
+    return results
+
+
+def input_hash(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(output_file_path):
+    # index -> record from an earlier (possibly interrupted) run; a torn last line is ignored
+    records = {}
+    if not os.path.exists(output_file_path):
+        return records
+    with open(output_file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "index" in record and "input_hash" in record:
+                records[record["index"]] = record
+    return records
+
+
+def write_records(path, records):
+    # rewrites a JSONL file through a temporary file, so a crash mid-write leaves the old copy intact
+    with jsonlines.open(f"{path}.tmp", mode="w") as writer:
+        writer.write_all(records)
+    os.replace(f"{path}.tmp", path)
+
+
+def end_with_newline(path):
+    # a crash can leave a torn last line, start appending on a fresh one
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def load_queries(query_file):
     with open(query_file, "r", encoding="utf-8") as f:
         data = f.read()
+    return re.findall(r"- Question \d+: (.+)", data)
+
 
-    queries = re.findall(r"- Question \d+: (.+)", data)
+def load_answers(result_file):
+    # a converted answer file keeps one "result" column
+    if is_parquet(result_file):
+        return load_columns(result_file, ["result"])["result"]
+    with open(result_file, "r", encoding="utf-8") as f:
+        answers = json.load(f)
+    return [i["result"] for i in answers]
 
-    # read first answer file
-    with open(result1_file, "r", encoding="utf-8") as f:
-        answers1 = json.load(f)
-    answers1 = [i["result"] for i in answers1]
 
-    # read second answer file
-    with open(result2_file, "r", encoding="utf-8") as f:
-        answers2 = json.load(f)
-    answers2 = [i["result"] for i in answers2]
+def load_items(query_file, result1_file, result2_file):
+    # (query, answer1, answer2) per question, None when the files don't line up
+    queries = load_queries(query_file)
+    # read first and second answer file
+    answers1 = load_answers(result1_file)
+    answers2 = load_answers(result2_file)
 
     if not (len(queries) == len(answers1) == len(answers2)):
         print("Warning: the number of query and answer does not match, please check!")
+        return None
+    return list(zip(queries, answers1, answers2))
+
+
+def truncate_items(items, max_answer_tokens, model=MODEL):
+    # caps both answers of every (query, answer1, answer2) at max_answer_tokens before they are judged
+    truncated = [(query, truncate_text(answer1, max_answer_tokens, model), truncate_text(answer2, max_answer_tokens, model))
+                 for query, answer1, answer2 in items]
+    changed = sum(a1 != t1 or a2 != t2 for (_, a1, a2), (_, t1, t2) in zip(items, truncated))
+    if changed:
+        print(f"Truncated answers of {changed}/{len(items)} questions to {max_answer_tokens} tokens")
+    return truncated
+
+
+def usage_path(output_file_path):
+    return f"{os.path.splitext(output_file_path)[0]}.usage.json"
+
+
+def batch_eval(query_file, result1_file, result2_file, output_file_path, api_key=None, base_url=None,
+               rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE, concurrency=CONCURRENCY, model=MODEL, shard=None,
+               max_tokens=MAX_TOKENS, budget=None, max_answer_tokens=None, preflight_only=False):
+    # Openai configuration, falls back to OPENAI_API_KEY / OPENAI_BASE_URL; retries are handled by judge()
+    client = AsyncOpenAI(
+        api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+        base_url=base_url or os.environ.get("OPENAI_BASE_URL"),
+        max_retries=0,
+    )
+
+    items = load_items(query_file, result1_file, result2_file)
+    if items is None:
         return
+    # hashed after truncation, a judgment is only reused for the exact prompt it was made on
+    if max_answer_tokens:
+        items = truncate_items(items, max_answer_tokens, model)
+    hashes = [input_hash(model, *item) for item in items]
 
-    evaluations = []
-
-    for i, (query, answer1, answer2) in enumerate(zip(queries, answers1, answers2), start=1):
-        sys_prompt = """
-        ---Role---
-        You are an expert tasked with evaluating two answers to the same question based on five criteria: **Accuracy**, **Comprehensiveness**, **Diversity**, **Empowerment**, and **Hallucination**.
-        """
-
-        prompt = f"""
-        You will evaluate two answers to the same question based on five criteria: **Accuracy**, **Comprehensiveness**, **Diversity**, **Empowerment**, and **Hallucination**.
-
-        - **Accuracy**: How correct and factual is the information provided in the answer?
-        - **Comprehensiveness**: How much detail does the answer provide to cover all aspects and details of the question?
-        - **Diversity**: How varied and rich is the answer in providing different perspectives and insights on the question?
-        - **Empowerment**: How well does the answer help the reader understand and make informed judgments about the topic?
-        - **Hallucination**: How free is the answer from fabricated or unsupported information?
-
-        For each criterion, choose the better answer (either Answer 1 or Answer 2) and explain why. Then, select an overall winner based on these five categories.
-
-        Here is the question:
-        {query}
-
-        Here are the two answers:
-
-        **Answer 1:**
-        {answer1}
-
-        **Answer 2:**
-        {answer2}
-
-        Evaluate both answers using the five criteria listed above and provide detailed explanations for each criterion.
-
-        Output your evaluation in the following JSON format, do not contain the "json" identifier at the beginning and end!!!:
-
-        {{
-            "Accuracy": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Provide explanation here]"
-            }},
-            "Comprehensiveness": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Provide explanation here]"
-            }},
-            "Diversity": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Provide explanation here]"
-            }},
-            "Empowerment": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Provide explanation here]"
-            }},
-            "Hallucination": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Provide explanation here]"
-            }},
-            "Overall Winner": {{
-                "Winner": "[Answer 1 or Answer 2]",
-                "Explanation": "[Summarize why this answer is the overall winner based on the five criteria]"
-            }}
-        }}
+    # a shard (i, N) judges only the questions hashed to it, into its own shard-i-of-N file;
+    # record indices stay positions in the full question list so shards can be merged
+    indices = list(range(len(items)))
+    labels = {"systems": [os.path.splitext(os.path.basename(path))[0] for path in (result1_file, result2_file)]}
+    if shard is not None:
+        indices = select_shard([item[0] for item in items], shard)
+        output_file_path = shard_path(output_file_path, shard)
+        labels["shard"] = f"{shard[0]}/{shard[1]}"
+        # every shard process gets the same --budget, so each may spend its share of it
+        if budget is not None:
+            budget /= shard[1]
 
-        The output should not contain any extra characters or text outside of this JSON structure.
-        Do NOT contain the "json" identifier at the beginning and end.
-        """
+    # skip questions already judged for identical inputs by an earlier run
+    resuming = os.path.exists(output_file_path)
+    checkpoint = load_checkpoint(output_file_path)
+    done = {
+        index: {key: value for key, value in record.items() if key not in ("index", "input_hash")}
+        for index, record in checkpoint.items()
+        if index < len(items) and record["input_hash"] == hashes[index]
+    }
+    if done:
+        print(f"Resuming, {len(done)}/{len(indices)} evaluations already in {output_file_path}")
 
-        messages = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": prompt},
-        ]
+    # sized locally before anything is sent
+    estimate = preflight(
+        [(f"question {i + 1}", build_messages(*items[i])) for i in indices if i not in done], model, max_tokens, rpm, tpm
+    )
+    print(format_preflight(estimate))
+    if preflight_only:
+        return estimate
+    # a resumed run adds to the spend recorded so far, the budget covers the whole job
+    usage = UsageTracker(model, budget)
+    if resuming:
+        usage.load(usage_path(output_file_path))
 
-        # try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.0,
-            max_tokens=1500,
-        )
+    end_with_newline(output_file_path)
 
-        max_retries = 3  # max retry
-        retry_delay = 1
+    # every judgment is appended and flushed as soon as it arrives; the usage file is written
+    # even when the run is interrupted, so the next resume knows what was already spent
+    try:
+        with jsonlines.open(output_file_path, mode="a", flush=True) as writer:
+            def on_result(index, evaluation):
+                writer.write({"index": index, "input_hash": hashes[index], **evaluation})
 
-        response = response.choices[0].message.content
-        for attempt in range(max_retries):
-            try:
-                evaluation = json.loads(response)
-                evaluations.append(evaluation)
-                print(f"Successfully evaluate {i}/{len(queries)}")
-                break
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                else:
-                    print("Failed after maximum retries")
+            limiter = TokenBucketLimiter(rpm, tpm)
+            results = asyncio.run(abatch_eval(
+                items, client, limiter, concurrency, model, max_tokens, done=done, on_result=on_result, indices=indices,
+                usage=usage, labels=[labels] * len(items),
+            ))
+    finally:
+        usage.write(usage_path(output_file_path))
+
+    # compact to one record per question in question order, dropping stale judgments
+    write_records(output_file_path, (
+        {"index": index, "input_hash": hashes[index], **evaluation}
+        for index, evaluation in enumerate(results) if evaluation is not None
+    ))
+
+    evaluations = [evaluation for evaluation in results if evaluation is not None]
+    print(f"All evaluation completed, {len(evaluations)}/{len(indices)} results are written to {output_file_path}")
+    print(usage.format_summary())
+
+
+def merge_eval_shards(query_file, result1_file, result2_file, output_file_path, count, rerun=True, model=MODEL,
+                      max_answer_tokens=None, **kwargs):
+    # Rebuilds output_file_path in question order from the shard files of a `--shard i/count` run,
+    # keeping only judgments whose inputs still match, and its usage file from the shards' usage plus
+    # what earlier merges re-ran. When rerun is set, batch_eval then resumes from the merged files,
+    # so only the questions no shard judged cost a call and the budget covers the shards' spend too.
+    items = load_items(query_file, result1_file, result2_file)
+    if items is None:
+        return
+    if max_answer_tokens:
+        items = truncate_items(items, max_answer_tokens, model)
+    hashes = [input_hash(model, *item) for item in items]
+    # the merged file itself goes first, it holds what earlier merges re-ran
+    records, missing, duplicates, stale = collect([output_file_path] + shard_paths(output_file_path, count), hashes, "input_hash")
+    print(f"{count} shards: {len(records)}/{len(items)} judged, {len(missing)} missing, "
+          f"{duplicates} duplicated, {stale} stale")
+
+    write_records(output_file_path, (records[index] for index in sorted(records)))
+
+    usage = UsageTracker(model)
+    usage.load(usage_path(output_file_path), keep=lambda call: "shard" not in call)
+    for path in shard_paths(output_file_path, count):
+        usage.load(usage_path(path))
+    usage.write(usage_path(output_file_path))
+    print(f"Shards and earlier re-runs: {usage.format_summary()}")
 
-    with jsonlines.open(output_file_path, mode="w") as writer:
-        for eval_item in evaluations:
-            writer.write(eval_item)
+    if missing and rerun:
+        print(f"Re-running {len(missing)} evaluation(s)")
+        batch_eval(query_file, result1_file, result2_file, output_file_path, model=model,
+                   max_answer_tokens=max_answer_tokens, **kwargs)
+    return missing
 
-    print(f"All evaluation completed, results are written to {output_file_path}")
 
 if __name__ == "__main__":
-    query_file = "questions.txt"
-    result1_file = "answer1.json"
-    result2_file = "answer2.json"
-    output_file_path = "xxx.jsonl"
+    parser = argparse.ArgumentParser(description="Judge two answer files against each other question by question")
+    parser.add_argument("--queries", default="questions.txt")
+    parser.add_argument("--result1", default="answer1.json")
+    parser.add_argument("--result2", default="answer2.json")
+    parser.add_argument("--output", default="xxx.jsonl")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE)
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--shard", type=parse_shard, default=None, help="i/N: only judge the questions hashed to shard i of N")
+    parser.add_argument("--merge", type=int, default=None, metavar="N", help="merge the outputs of N shards and re-run the gaps")
+    parser.add_argument("--no-rerun", action="store_true", help="with --merge, only report the gaps")
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="completion tokens allowed per judgment")
+    parser.add_argument("--budget", type=float, default=None, help="stop sending once this much USD could be spent; each of N shards gets budget/N, a merge counts their spend")
+    parser.add_argument("--max-answer-tokens", type=int, default=None, help="truncate longer answers before judging")
+    parser.add_argument("--preflight", action="store_true", help="only print the local token and cost estimate")
+    args = parser.parse_args()
 
-    batch_eval(query_file, result1_file, result2_file, output_file_path)
+    options = dict(rpm=args.rpm, tpm=args.tpm, concurrency=args.concurrency, model=args.model, max_tokens=args.max_tokens,
+                   budget=args.budget, max_answer_tokens=args.max_answer_tokens, preflight_only=args.preflight)
+    if args.merge:
+        merge_eval_shards(args.queries, args.result1, args.result2, args.output, args.merge, not args.no_rerun, **options)
+    else:
+        batch_eval(args.queries, args.result1, args.result2, args.output, shard=args.shard, **options)
@@ -1,4 +1,12 @@
-import subprocess
+import argparse
+import asyncio
+import json
+import os
+
+from query_cache import get_query_cache
+from query_engine import format_response, get_engine
+from sharding import collect, gaps_path, parse_shard, select_shard, shard_path, shard_paths
+from tracing import DEFAULT_TRACE_PATH, span, summarize, trace, write_chrome_trace, write_traces
 
 # Question Set
 questions = [
@@ -56,26 +64,175 @@ questions = [
 
 output_file = "output.txt"
 
-# Question Loop
-counter = 1
-with open(output_file, "w") as f:
-    for question in questions:
-        command = [
-            "python", "-m", "graphrag", "query", 
-            "--root", "./projects/Solana", 
-            "--method", "drift", 
-            "--query", question,
-        ]
-        try:
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            f.write(f"Question: {question}\n")
-            f.write(f"Answer:\n{result.stdout}\n")
-            f.write("="*80 + "\n")
-            print(f"Question {counter} Success")
-        except subprocess.CalledProcessError as e:
-            f.write(f"Error occurred while querying: {question}\n")
-            f.write(f"Error message: {e.stderr}\n")
-            f.write("="*80 + "\n")
-            print(f"---------------------- Question {counter} Fail ----------------------")
-        counter += 1
-print(f"Results saved to {output_file}")
+
+def records_path(path):
+    # output.shard-1-of-4.txt -> output.shard-1-of-4.jsonl, the shard's answers in a form a merge can read back
+    return f"{os.path.splitext(path)[0]}.jsonl"
+
+
+def format_result(question, ok, text):
+    if ok:
+        return f"Question: {question}\nAnswer:\n{text}\n" + "="*80 + "\n"
+    return (
+        f"Error occurred while querying: {question}\n"
+        f"Error message: {text}\n" + "="*80 + "\n"
+    )
+
+
+async def run_engine_query(question, root, method, use_cache=True):
+    cache = get_query_cache()
+    if use_cache:
+        with span("cache_lookup") as attrs:
+            cached = cache.get(root, method, question)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return True, format_response(method, cached[0])
+    try:
+        response, context_data = await get_engine(root).aquery(method, question)
+    except Exception as e:
+        return False, f"{e}"
+    with span("cache_write"):
+        cache.put(root, method, question, str(response), context_data)
+    return True, format_response(method, response)
+
+
+async def run_subprocess_query(question, root, method):
+    command = [
+        "python", "-m", "graphrag", "query",
+        "--root", root,
+        "--method", method,
+        "--query", question,
+    ]
+    with span("process_spawn"):
+        proc = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    # graphrag import, index load and search all happen inside the child process
+    with span("subprocess_query"):
+        stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        return False, stderr.decode(errors="replace")
+    return True, stdout.decode(errors="replace")
+
+
+async def run_batch(questions, root="./projects/Solana", method="drift", workers=4, output_file=output_file, use_subprocess=False, use_cache=True,
+                    trace_file=DEFAULT_TRACE_PATH, chrome_trace_file=None, shard=None, indices=None, records_file=None):
+    # results are returned (and written) in input order, even though queries finish out of order.
+    # With shard=(i, N) only that shard's questions run, into output_file's shard-i-of-N files;
+    # indices picks questions by position instead, records_file gets one JSON line per answer
+    # appended (a shard starts its own records afresh)
+    if shard is not None:
+        indices = select_shard(questions, shard)
+        output_file = shard_path(output_file, shard)
+        records_file = records_path(output_file)
+        open(records_file, "w").close()
+    if indices is None:
+        indices = list(range(len(questions)))
+    questions = [questions[i] for i in indices]
+    semaphore = asyncio.Semaphore(workers)
+    results = [None] * len(questions)
+    traces = [None] * len(questions)
+    next_to_write = 0
+
+    # truncate once, then append each result as soon as its turn comes
+    open(output_file, "w").close()
+
+    async def worker(index, question):
+        nonlocal next_to_write
+        async with semaphore:
+            # the trace starts once a worker slot is free, queueing time is not a stage
+            with trace("query", question=question, method=method, root=root, subprocess=use_subprocess) as query_trace:
+                if use_subprocess:
+                    ok, text = await run_subprocess_query(question, root, method)
+                else:
+                    ok, text = await run_engine_query(question, root, method, use_cache)
+            query_trace.attrs["ok"] = ok
+        results[index] = (question, ok, text)
+        traces[index] = query_trace
+        if ok:
+            print(f"Question {indices[index] + 1} Success")
+        else:
+            print(f"---------------------- Question {indices[index] + 1} Fail ----------------------")
+
+        with open(output_file, "a") as f:
+            while next_to_write < len(results) and results[next_to_write] is not None:
+                f.write(format_result(*results[next_to_write]))
+                if records_file:
+                    with open(records_file, "a", encoding="utf-8") as records:
+                        question, ok, text = results[next_to_write]
+                        record = {"index": indices[next_to_write], "question": question, "ok": ok, "text": text}
+                        records.write(json.dumps(record, ensure_ascii=False) + "\n")
+                next_to_write += 1
+
+    await asyncio.gather(*(worker(i, q) for i, q in enumerate(questions)))
+
+    write_traces(traces, trace_file)
+    records = [query_trace.to_record() for query_trace in traces]
+    if chrome_trace_file:
+        write_chrome_trace(records, chrome_trace_file)
+    print("Latency per stage (ms):")
+    print(summarize(records).to_string())
+    return results
+
+
+async def merge_shards(questions, count, output_file=output_file, rerun=True, **kwargs):
+    # Rebuilds output_file in question order from the shard files of a `--shard i/count` run.
+    # Answers that no shard wrote, or that failed, are re-run once (appended to the .gaps records,
+    # so answers an earlier merge recovered are kept) when rerun is set; kwargs go to run_batch for that.
+    paths = [records_path(path) for path in shard_paths(output_file, count)] + [records_path(gaps_path(output_file))]
+    records, missing, duplicates, stale = collect(paths, questions, "question")
+    failed = [index for index, record in records.items() if not record["ok"]]
+    answered = len(records) - len(failed)
+    print(f"{count} shards: {len(records) - len(failed)}/{len(questions)} answered, {len(failed)} failed, "
+          f"{len(missing)} missing, {duplicates} duplicated, {stale} stale")
+
+    gaps = sorted(missing + failed)
+    if gaps and rerun:
+        print(f"Re-running {len(gaps)} question(s)")
+        await run_batch(questions, output_file=gaps_path(output_file), indices=gaps,
+                        records_file=records_path(gaps_path(output_file)), **kwargs)
+        records, missing, duplicates, stale = collect(paths, questions, "question")
+        rerun_answered = sum(record["ok"] for record in records.values())
+        # a re-run only ever adds answers, fewer would mean earlier records were lost
+        if rerun_answered < answered:
+            raise RuntimeError(f"merge lost answers: {answered} answered before the re-run, {rerun_answered} after")
+        print(f"After the re-run: {rerun_answered}/{len(questions)} answered")
+
+    with open(output_file, "w") as f:
+        for index, question in enumerate(questions):
+            record = records.get(index)
+            if record is None:
+                f.write(format_result(question, False, "no shard produced an answer"))
+            else:
+                f.write(format_result(question, record["ok"], record["text"]))
+    return records, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the question set against a graphrag project")
+    parser.add_argument("--root", default="./projects/Solana")
+    parser.add_argument("--method", default="drift", choices=["local", "global", "drift"])
+    parser.add_argument("--workers", type=int, default=4, help="number of queries to run concurrently")
+    parser.add_argument("--output", default=output_file)
+    parser.add_argument("--subprocess", action="store_true", help="spawn `graphrag query` per question instead of the in-process engine")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached answers and query again")
+    parser.add_argument("--trace", default=DEFAULT_TRACE_PATH, help="JSONL file the per-query spans are appended to")
+    parser.add_argument("--chrome-trace", default=None, help="also write the spans in Chrome trace format")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="i/N: only answer the questions hashed to shard i of N")
+    parser.add_argument("--merge", type=int, default=None, metavar="N", help="merge the outputs of N shards and re-run the gaps")
+    parser.add_argument("--no-rerun", action="store_true", help="with --merge, only report the gaps")
+    args = parser.parse_args()
+
+    if args.merge:
+        asyncio.run(merge_shards(
+            questions, args.merge, args.output, not args.no_rerun, root=args.root, method=args.method,
+            workers=max(1, args.workers), use_subprocess=args.subprocess, use_cache=not args.no_cache,
+            trace_file=args.trace, chrome_trace_file=args.chrome_trace,
+        ))
+        print(f"Merged results saved to {args.output}")
+    else:
+        asyncio.run(run_batch(
+            questions, args.root, args.method, max(1, args.workers), args.output, args.subprocess, not args.no_cache,
+            args.trace, args.chrome_trace, args.shard,
+        ))
+        print(f"Results saved to {shard_path(args.output, args.shard) if args.shard else args.output}")
@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import time
+
+# profiles.py and synthetic.py live in bench/, two levels up from this package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from profiles import first_token_delay, load_profile, should_fail, token_delay  # noqa: E402
+
+# Stand-in for the graphrag CLI: same subcommands and flags the UI and batch scripts use,
+# timed by a bench profile instead of doing any work
+
+SEARCH_LABELS = {"local": "Local", "global": "Global", "drift": "DRIFT"}
+INDEX_WORKFLOWS = [
+    "create_base_text_units",
+    "create_final_documents",
+    "create_base_entity_graph",
+    "create_final_entities",
+    "create_final_nodes",
+    "create_final_communities",
+    "create_final_relationships",
+    "create_final_text_units",
+    "create_final_community_reports",
+    "generate_text_embeddings",
+]
+WORDS = "solana validators order transactions with proof of history before consensus votes on them".split()
+# tokens printed per write while an answer streams
+CHUNK_TOKENS = 8
+
+
+def stream_answer(profile, method, question, tokens):
+    print(f"SUCCESS: {SEARCH_LABELS[method]} Search Response:", flush=True)
+    words = [f"Answer to {question}"] + [WORDS[i % len(WORDS)] for i in range(tokens)]
+    for begin in range(0, len(words), CHUNK_TOKENS):
+        chunk = words[begin:begin + CHUNK_TOKENS]
+        time.sleep(token_delay(profile, len(chunk)))
+        print(" ".join(chunk), end=" ", flush=True)
+    print(flush=True)
+
+
+def run_index(profile, root):
+    # one engine log line per workflow, the way jobs.parse_progress expects, then synthetic output;
+    # imported here so queries don't pay for pandas at startup
+    from synthetic import write_project
+
+    os.makedirs(os.path.join(root, "logs"), exist_ok=True)
+    with open(os.path.join(root, "logs", "indexing-engine.log"), "w", encoding="utf-8") as log:
+        for workflow in INDEX_WORKFLOWS:
+            log.write(f"INFO dependencies for {workflow}: []\n")
+            log.flush()
+            time.sleep(first_token_delay(profile))
+    write_project(root, int(os.environ.get("BENCH_INDEX_ROWS", 1000)))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="graphrag")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ["init", "index", "update", "prompt-tune", "query"]:
+        command = commands.add_parser(name)
+        command.add_argument("--root", default=".")
+    query = commands.choices["query"]
+    query.add_argument("--method", default="global", choices=list(SEARCH_LABELS))
+    query.add_argument("--query", required=True)
+    commands.choices["prompt-tune"].add_argument("--domain")
+    commands.choices["prompt-tune"].add_argument("--chunk-size")
+    args = parser.parse_args()
+
+    profile = load_profile()
+    if should_fail(profile):
+        time.sleep(first_token_delay(profile))
+        sys.exit(f"graphrag {args.command} failed (simulated by the {profile['name']} bench profile)")
+
+    if args.command == "init":
+        os.makedirs(os.path.join(args.root, "input"), exist_ok=True)
+        with open(os.path.join(args.root, "settings.yaml"), "w", encoding="utf-8") as f:
+            f.write("# written by the fake graphrag used for benchmarks\n")
+    elif args.command in ("index", "update"):
+        run_index(profile, args.root)
+    elif args.command == "prompt-tune":
+        time.sleep(first_token_delay(profile))
+    else:
+        time.sleep(first_token_delay(profile))
+        stream_answer(profile, args.method, args.query, int(os.environ.get("BENCH_RESPONSE_TOKENS", 300)))
+
+
+if __name__ == "__main__":
+    main()
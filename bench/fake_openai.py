@@ -0,0 +1,118 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from profiles import PROFILES, first_token_delay, load_profile, should_fail, token_delay
+
+# the judge's reply format, see batch_customized_eval.build_messages
+CRITERIA = ["Accuracy", "Comprehensiveness", "Diversity", "Empowerment", "Hallucination", "Overall Winner"]
+
+
+def count_tokens(text):
+    # the same 4 characters per token rule the judge's rate limiter uses
+    return max(1, len(text) // 4)
+
+
+def completion_text(messages, max_tokens):
+    # a judge verdict when the prompt asks for one, filler text otherwise; the winner follows a hash
+    # of the prompt, so the same comparison always gets the same verdict
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    if "Overall Winner" in prompt:
+        return json.dumps({
+            criterion: {"Winner": f"Answer {digest[i] % 2 + 1}", "Explanation": "Synthetic verdict from the bench server."}
+            for i, criterion in enumerate(CRITERIA)
+        }, indent=4)
+    return " ".join(["lorem"] * min(max_tokens or 256, 256))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # POST /v1/chat/completions with the profile's latency, token rate and error rate
+    profile = PROFILES["instant"]
+    counter = 0
+    counter_lock = threading.Lock()
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"{self.path} is not served by the bench server"}})
+            return
+        with self.counter_lock:
+            type(self).counter += 1
+            rng = random.Random(type(self).counter)
+
+        profile = self.profile
+        time.sleep(first_token_delay(profile, rng))
+        if should_fail(profile, rng):
+            # alternate between a rate limit (with a short retry-after) and a server error
+            if rng.random() < 0.5:
+                self._send(429, {"error": {"message": "Rate limit reached (simulated)", "type": "rate_limit"}},
+                           {"retry-after": "0.1"})
+            else:
+                self._send(500, {"error": {"message": "Internal error (simulated)", "type": "server_error"}})
+            return
+
+        messages = request.get("messages", [])
+        text = completion_text(messages, request.get("max_tokens"))
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) for message in messages)
+        completion_tokens = count_tokens(text)
+        time.sleep(token_delay(profile, completion_tokens))
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(profile, host="127.0.0.1", port=0):
+    # starts the server on a background thread; returns (server, base_url), stop with server.shutdown()
+    handler = type("ProfiledHandler", (FakeOpenAIHandler,), {"profile": profile, "counter": 0})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible endpoint for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", default=None, choices=list(PROFILES))
+    parser.add_argument("--latency", type=float, default=None)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=None)
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                           error_rate=args.error_rate)
+    server, base_url = serve(profile, args.host, args.port)
+    print(f"Serving {profile['name']} profile at {base_url}, set OPENAI_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,50 @@
+import os
+import random
+
+# Response profiles shared by the fake graphrag CLI and the fake OpenAI server. A reply takes
+# latency (+/- jitter) seconds to start, then streams its tokens at tokens_per_second (0 means
+# at once); error_rate is the chance a call fails instead.
+PROFILES = {
+    "instant": {"latency": 0.0, "jitter": 0.0, "tokens_per_second": 0, "error_rate": 0.0},
+    "typical": {"latency": 0.4, "jitter": 0.2, "tokens_per_second": 100, "error_rate": 0.0},
+    "slow": {"latency": 2.0, "jitter": 0.5, "tokens_per_second": 25, "error_rate": 0.0},
+    "flaky": {"latency": 0.4, "jitter": 0.2, "tokens_per_second": 100, "error_rate": 0.1},
+}
+
+DEFAULT_PROFILE = "instant"
+
+# BENCH_<FIELD> environment variables override single fields of the chosen profile
+ENV_PREFIX = "BENCH_"
+
+
+def load_profile(name=None, **overrides):
+    # the named profile (default BENCH_PROFILE, else instant), then env overrides, then keyword ones
+    name = name or os.environ.get(f"{ENV_PREFIX}PROFILE", DEFAULT_PROFILE)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile {name!r}, expected one of {', '.join(PROFILES)}")
+    profile = dict(PROFILES[name], name=name)
+    for field, value in PROFILES[name].items():
+        env = os.environ.get(f"{ENV_PREFIX}{field.upper()}")
+        if env is not None:
+            profile[field] = type(value)(float(env))
+    profile.update({field: value for field, value in overrides.items() if value is not None})
+    return profile
+
+
+def profile_env(profile):
+    # environment that hands a profile to a stand-in running as a child process
+    env = {f"{ENV_PREFIX}PROFILE": profile["name"]}
+    env.update({f"{ENV_PREFIX}{field.upper()}": str(profile[field]) for field in PROFILES[profile["name"]]})
+    return env
+
+
+def first_token_delay(profile, rng=random):
+    return max(0.0, profile["latency"] + rng.uniform(-profile["jitter"], profile["jitter"]))
+
+
+def token_delay(profile, tokens):
+    return tokens / profile["tokens_per_second"] if profile["tokens_per_second"] else 0.0
+
+
+def should_fail(profile, rng=random):
+    return rng.random() < profile["error_rate"]
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(1, REPO_DIR)
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from batch_customized_eval import TokenBucketLimiter, abatch_eval  # noqa: E402
+from batch_queries import questions as QUESTIONS, run_batch  # noqa: E402
+from dataset_io import load_columns  # noqa: E402
+from fake_openai import serve  # noqa: E402
+from graph_index import GraphIndex, build_graph_index, graph_index_dir, load_graph_index  # noqa: E402
+from graph_layout import get_layout, node_coordinates, spring_layout  # noqa: E402
+from profiles import PROFILES, load_profile, profile_env  # noqa: E402
+from query_graph import MAX_NODES, build_graph, generate_query_visulization  # noqa: E402
+from synthetic import SIZES, project_for  # noqa: E402
+from tracing import load_traces, summarize  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BENCHMARKS = ["batch_queries", "judge", "parquet", "graph", "render"]
+
+# the force layout is O(iterations * (nodes + edges)) with a large constant, skipped above this
+LAYOUT_MAX_ROWS = 100_000
+# entity names looked up per lookup benchmark
+LOOKUPS = 1000
+# relative change past which --compare reports a regression
+THRESHOLD = 0.1
+
+
+@contextlib.contextmanager
+def quiet():
+    # the batch scripts print a line per item, keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def patched_env(values):
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def timed(fn, repeat=3):
+    # (median seconds over `repeat` runs, last result)
+    durations, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def bench_batch_queries(profile, count=50, workers=8):
+    # batch_queries.py in --subprocess mode against the fake graphrag CLI
+    env = {
+        "PATH": os.path.join(BENCH_DIR, "bin") + os.pathsep + os.environ.get("PATH", ""),
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.join(BENCH_DIR, "fake_graphrag"), os.environ.get("PYTHONPATH")])),
+        **profile_env(profile),
+    }
+    questions = list(itertools.islice(itertools.cycle(QUESTIONS), count))
+    with tempfile.TemporaryDirectory() as tmp, patched_env(env):
+        trace_file = os.path.join(tmp, "traces.jsonl")
+        start = time.perf_counter()
+        with quiet():
+            results = asyncio.run(run_batch(
+                questions, root=tmp, method="local", workers=workers, output_file=os.path.join(tmp, "output.txt"),
+                use_subprocess=True, use_cache=False, trace_file=trace_file,
+            ))
+        wall = time.perf_counter() - start
+        stages = summarize(load_traces(trace_file))
+    return {
+        "questions": count,
+        "workers": workers,
+        "wall_s": wall,
+        "questions_per_s": count / wall,
+        "failed": sum(not ok for _, ok, _ in results),
+        "query_p50_ms": float(stages.loc["query", "p50_ms"]),
+        "query_p95_ms": float(stages.loc["query", "p95_ms"]),
+        "spawn_p50_ms": float(stages.loc["process_spawn", "p50_ms"]),
+    }
+
+
+def judge_items(count):
+    # (question, answer 1, answer 2) from the checked-in datasets, so prompts have realistic sizes
+    first = load_columns(os.path.join(REPO_DIR, "dataset_graphrag.json"), ["user_input", "response"])
+    second = load_columns(os.path.join(REPO_DIR, "dataset_lightrag.json"), ["response"])
+    items = list(zip(first["user_input"], first["response"], second["response"]))
+    return list(itertools.islice(itertools.cycle(items), count))
+
+
+def bench_judge(profile, count=200, concurrency=16):
+    # abatch_eval against the fake OpenAI server, limiter wide open so only the pipeline is measured
+    server, base_url = serve(profile)
+    try:
+        client = AsyncOpenAI(api_key="bench", base_url=base_url, max_retries=0)
+        limiter = TokenBucketLimiter(rpm=10 ** 7, tpm=10 ** 10)
+        items = judge_items(count)
+        start = time.perf_counter()
+        with quiet():
+            results = asyncio.run(abatch_eval(items, client, limiter, concurrency))
+        wall = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    return {
+        "judgments": count,
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "judgments_per_s": count / wall,
+        "failed": sum(result is None for result in results),
+    }
+
+
+def bench_parquet(size, repeat=3):
+    # reading the entity table and looking entities up through the graph index
+    root = project_for(size)
+    path = os.path.join(root, "output", "create_final_entities.parquet")
+    graph_index = load_graph_index(root)
+    read_s, entities = timed(lambda: pd.read_parquet(path), repeat)
+    columns_s, _ = timed(lambda: pd.read_parquet(path, columns=["human_readable_id", "title"]), repeat)
+    open_s, _ = timed(lambda: GraphIndex(graph_index_dir(root)).node_table(), repeat)
+
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(entities), size=LOOKUPS)
+    names = entities["title"].to_numpy()[picks].tolist()
+    ids = entities["human_readable_id"].to_numpy()[picks].tolist()
+    name_s, _ = timed(lambda: graph_index.name_positions(names), repeat)
+    id_s, _ = timed(lambda: graph_index.positions(ids), repeat)
+    seeds = graph_index.positions(ids[:10])
+    k_hop_s, _ = timed(lambda: graph_index.k_hop(seeds, hops=2, max_degree=20, max_nodes=MAX_NODES), repeat)
+    return {
+        "rows": SIZES[size],
+        "read_entities_s": read_s,
+        "read_columns_s": columns_s,
+        "open_index_s": open_s,
+        "name_lookup_us": name_s / LOOKUPS * 1e6,
+        "id_lookup_us": id_s / LOOKUPS * 1e6,
+        "k_hop_ms": k_hop_s * 1000,
+    }
+
+
+def subgraph(graph_index, seed=0):
+    # a cited-entity sized neighborhood, like the Query page draws for one answer
+    rng = np.random.default_rng(seed)
+    seeds = rng.integers(0, graph_index.num_nodes, size=10)
+    positions, rows = graph_index.k_hop(seeds, hops=2, max_degree=20, max_nodes=MAX_NODES)
+    return graph_index.records(positions, rows)
+
+
+def bench_graph(size, repeat=3):
+    # CSR index build, the per-answer vis graph build, and (up to LAYOUT_MAX_ROWS) the force layout
+    root = project_for(size)
+    build_s, _ = timed(lambda: build_graph_index(root), 1)
+    graph_index = load_graph_index(root)
+    entities, relations = subgraph(graph_index)
+    vis_s, (nodes, edges, _) = timed(lambda: build_graph(entities, relations), repeat)
+    result = {
+        "rows": SIZES[size],
+        "build_index_s": build_s,
+        "build_graph_ms": vis_s * 1000,
+        "graph_nodes": len(nodes),
+        "graph_edges": len(edges),
+    }
+    if SIZES[size] <= LAYOUT_MAX_ROWS:
+        result["layout_s"], _ = timed(lambda: spring_layout(graph_index.indptr, graph_index.indices), 1)
+    return result
+
+
+def bench_render(size, repeat=3):
+    # query_graph.generate_query_visulization on a subgraph, with and without precomputed positions
+    graph_index = load_graph_index(project_for(size))
+    entities, relations = subgraph(graph_index)
+    context_data = {
+        "entities": [
+            {"id": str(row.human_readable_id), "entity": row.name, "type": row.type, "description": row.description}
+            for row in entities.itertuples()
+        ],
+        "relationships": [
+            {"id": str(row.human_readable_id), "source": row.source, "target": row.target, "description": row.description}
+            for row in relations.itertuples()
+        ],
+    }
+    render_s, (html, _) = timed(lambda: generate_query_visulization(context_data), repeat)
+    result = {"rows": SIZES[size], "render_ms": render_s * 1000, "html_kb": len(html) / 1024}
+    if SIZES[size] <= LAYOUT_MAX_ROWS:
+        get_layout(graph_index)
+        coordinates = lambda names: node_coordinates(graph_index, names)  # noqa: E731
+        placed_s, _ = timed(lambda: generate_query_visulization(context_data, coordinates=coordinates), repeat)
+        result["render_positioned_ms"] = placed_s * 1000
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(benchmarks, sizes, profile, questions, workers, judgments, concurrency, repeat):
+    results = {}
+
+    def record(name, fn, *args):
+        print(f"{name} ...", flush=True)
+        results[name] = fn(*args)
+        print("  " + ", ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                               for key, value in results[name].items()), flush=True)
+
+    if "batch_queries" in benchmarks:
+        record("batch_queries", bench_batch_queries, profile, questions, workers)
+    if "judge" in benchmarks:
+        record("judge", bench_judge, profile, judgments, concurrency)
+    for size in sizes:
+        # graph rebuilds the index the other size benchmarks read, so it goes first
+        for name, fn in [("graph", bench_graph), ("parquet", bench_parquet), ("render", bench_render)]:
+            if name in benchmarks:
+                record(f"{name}_{size}", fn, size, repeat)
+
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "profile": profile,
+        "results": results,
+    }
+
+
+def direction(metric):
+    # +1 when higher is better, -1 when lower is better, 0 for sizes and counts
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_s", "_ms", "_us")):
+        return -1
+    return 0
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    # prints every shared timing metric and returns the ones that got worse by more than threshold
+    regressions = []
+    print(f"{'benchmark':<18} {'metric':<22} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(name, {}).get(metric)
+            sign = direction(metric)
+            if old is None or sign == 0 or not old:
+                continue
+            change = (value - old) / old
+            worse = -sign * change > threshold
+            print(f"{name:<18} {metric:<22} {old:>12.4g} {value:>12.4g} {change:>+8.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append((name, metric, old, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the batch scripts and graph code against local stand-ins")
+    parser.add_argument("--only", nargs="+", default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--profile", default=None, choices=list(PROFILES), help="stand-in latency profile (default instant)")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--judgments", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing, the median is kept")
+    parser.add_argument("--output", default=None, help="results file (default bench/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="compare BASELINE against CURRENT (or a fresh run) instead of only saving")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline file and optionally a current file")
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run(args.only, args.sizes, load_profile(args.profile), args.questions, args.workers,
+                      args.judgments, args.concurrency, args.repeat)
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{current['timestamp'].replace(':', '')}-{(current['commit'] or 'nogit')[:8]}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results are written to {output}")
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,91 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+ENTITY_TYPES = ["ORGANIZATION", "PERSON", "GEO", "EVENT", "TECHNOLOGY", "TOKEN"]
+WORDS = (
+    "network validator block ledger consensus stake token proof history throughput fee wallet program "
+    "account cluster leader vote slot epoch signature transaction protocol bridge market liquidity "
+    "developer runtime memory storage replication schedule reward security"
+).split()
+# distinct descriptions generated per table, rows pick among them so 1M rows stay cheap to build
+DESCRIPTION_POOL = 4096
+SEED = 7
+
+
+def _descriptions(rng, rows, words=24):
+    picks = rng.integers(0, len(WORDS), size=(DESCRIPTION_POOL, words))
+    pool = np.array([" ".join(WORDS[i] for i in row).capitalize() + "." for row in picks], dtype=object)
+    return pool[rng.integers(0, DESCRIPTION_POOL, size=rows)]
+
+
+def synthetic_tables(rows, seed=SEED):
+    # (create_final_entities, create_final_relationships) with `rows` rows each, in the graphrag 0.5
+    # layout; relationship endpoints follow a power law so there are hubs, like real extractions
+    rng = np.random.default_rng(seed)
+    titles = np.char.add("ENTITY_", np.arange(rows).astype(str)).astype(object)
+    entities = pd.DataFrame({
+        "id": [f"e{i:08x}" for i in range(rows)],
+        "human_readable_id": np.arange(rows, dtype=np.int64),
+        "title": titles,
+        "type": np.array(ENTITY_TYPES, dtype=object)[rng.integers(0, len(ENTITY_TYPES), size=rows)],
+        "description": _descriptions(rng, rows),
+        "text_unit_ids": [[f"t{i % 997}"] for i in range(rows)],
+    })
+
+    weights = 1 / (np.arange(rows) + 10.0)
+    weights /= weights.sum()
+    hubs = rng.permutation(rows)
+    sources = hubs[rng.choice(rows, size=rows, p=weights)]
+    targets = rng.integers(0, rows, size=rows)
+    targets = np.where(targets == sources, (targets + 1) % rows, targets)
+    relationships = pd.DataFrame({
+        "id": [f"r{i:08x}" for i in range(rows)],
+        "human_readable_id": np.arange(rows, dtype=np.int64),
+        "source": titles[sources],
+        "target": titles[targets],
+        "description": _descriptions(rng, rows),
+        "weight": rng.integers(1, 10, size=rows).astype(np.float64),
+        "combined_degree": np.zeros(rows, dtype=np.int64),
+        "text_unit_ids": [[f"t{i % 997}"] for i in range(rows)],
+    })
+    degree = np.bincount(np.concatenate([sources, targets]), minlength=rows)
+    relationships["combined_degree"] = degree[sources] + degree[targets]
+    return entities, relationships
+
+
+def write_project(root, rows, seed=SEED):
+    # a project folder whose output/ holds the synthetic tables, as after `graphrag index`
+    output = os.path.join(root, "output")
+    os.makedirs(output, exist_ok=True)
+    entities, relationships = synthetic_tables(rows, seed)
+    entities.to_parquet(os.path.join(output, "create_final_entities.parquet"), index=False)
+    relationships.to_parquet(os.path.join(output, "create_final_relationships.parquet"), index=False)
+    return root
+
+
+def project_for(size, seed=SEED):
+    # bench/data/<size>, generated on first use and reused by later runs
+    root = os.path.join(DATA_DIR, size)
+    if not os.path.exists(os.path.join(root, "output", "create_final_relationships.parquet")):
+        write_project(root, SIZES[size], seed)
+    return root
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic entity and relationship parquet files")
+    parser.add_argument("sizes", nargs="*", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        root = write_project(os.path.join(DATA_DIR, size), SIZES[size], args.seed)
+        print(f"{size}: {SIZES[size]} entities and relationships written to {root} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATASET_COLUMNS = ["user_input", "reference", "response", "retrieved_contexts"]
+
+# rows per Parquet row group, also the default batch size when iterating
+ROW_GROUP_SIZE = 1024
+
+DATASET_SCHEMA = pa.schema([
+    ("user_input", pa.string()),
+    ("reference", pa.list_(pa.string())),
+    ("response", pa.string()),
+    ("retrieved_contexts", pa.list_(pa.string())),
+])
+
+
+def is_parquet(path):
+    return path.endswith(".parquet")
+
+
+def system_name(path):
+    # dataset_graphrag.json / dataset_graphrag.parquet -> graphrag
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name[len("dataset_"):] if name.startswith("dataset_") else name
+
+
+def convert_dataset(json_path, parquet_path=None, row_group_size=ROW_GROUP_SIZE):
+    # dataset_x.json (a dict of equal-length columns) -> dataset_x.parquet next to it; answer
+    # files (a list of {"result": ...} records) are converted row by row
+    parquet_path = parquet_path or f"{os.path.splitext(json_path)[0]}.parquet"
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        table = pa.Table.from_pylist(data)
+    else:
+        columns = [name for name in DATASET_COLUMNS if name in data]
+        schema = pa.schema([DATASET_SCHEMA.field(name) for name in columns])
+        table = pa.table({name: data[name] for name in columns}, schema=schema)
+    pq.write_table(table, parquet_path, row_group_size=row_group_size, compression="zstd")
+    return parquet_path
+
+
+def num_rows(path):
+    if is_parquet(path):
+        return pq.ParquetFile(path, memory_map=True).metadata.num_rows
+    with open(path, "r", encoding="utf-8") as f:
+        return len(json.load(f)["user_input"])
+
+
+def iter_batches(path, columns=None, batch_size=ROW_GROUP_SIZE):
+    # yields {column: list of values} for batch_size rows at a time; a Parquet file is
+    # memory-mapped and only the requested columns are ever decoded
+    columns = columns or DATASET_COLUMNS
+    if is_parquet(path):
+        parquet = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+            yield {name: batch.column(name).to_pylist() for name in columns}
+        return
+    # the JSON layout has no partial read, the whole file is parsed once
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    total = len(data["user_input"])
+    for begin in range(0, total, batch_size):
+        yield {name: data[name][begin:begin + batch_size] for name in columns}
+
+
+def load_columns(path, columns=None):
+    # the requested columns of a whole dataset, in the same dict-of-lists shape as the JSON files
+    columns = columns or DATASET_COLUMNS
+    if is_parquet(path):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+        return {name: table.column(name).to_pylist() for name in columns}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {name: data[name] for name in columns}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert dataset_*.json and answer files to Parquet")
+    parser.add_argument("datasets", nargs="+")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    for path in args.datasets:
+        output = convert_dataset(path, row_group_size=args.row_group_size)
+        print(f"{path} -> {output} ({num_rows(output)} rows, {os.path.getsize(output)} bytes)")
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+GRAPH_INDEX_DIR = "graph_index"
+
+# CSR adjacency over entity positions: the neighbors of node i are indices[indptr[i]:indptr[i + 1]],
+# reached through the relationships at edge_rows[...] (rows of edges.parquet), heaviest first
+ARRAYS = ["node_ids", "indptr", "indices", "edge_rows"]
+
+SOURCE_TABLES = ["create_final_entities", "create_final_relationships"]
+
+
+def graph_index_dir(working_directory):
+    return os.path.join(working_directory, "output", GRAPH_INDEX_DIR)
+
+
+def source_path(working_directory, name):
+    return os.path.join(working_directory, "output", f"{name}.parquet")
+
+
+def source_version(working_directory):
+    # the index is stale as soon as graphrag rewrites either table
+    parts = []
+    for name in SOURCE_TABLES:
+        stat = os.stat(source_path(working_directory, name))
+        parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def _read_entities(path):
+    # graphrag renamed the entity name column to title in 0.5
+    name = "title" if "title" in pq.read_schema(path).names else "name"
+    entities = pd.read_parquet(path, columns=["human_readable_id", name, "type", "description"])
+    return entities.rename(columns={name: "name"})
+
+
+def build_graph_index(working_directory):
+    entities = _read_entities(source_path(working_directory, "create_final_entities"))
+    entities["human_readable_id"] = entities["human_readable_id"].astype(np.int64)
+    entities = entities.sort_values("human_readable_id", kind="stable").reset_index(drop=True)
+    relationships = pd.read_parquet(
+        source_path(working_directory, "create_final_relationships"),
+        columns=["human_readable_id", "source", "target", "description", "weight"],
+    )
+
+    # relationships name their endpoints, only those that are entities become edges
+    names = pd.Index(entities["name"])
+    sources = names.get_indexer(relationships["source"])
+    targets = names.get_indexer(relationships["target"])
+    rows = np.flatnonzero((sources >= 0) & (targets >= 0))
+
+    # exploration ignores direction, each relationship is listed under both endpoints
+    owners = np.concatenate([sources[rows], targets[rows]])
+    neighbors = np.concatenate([targets[rows], sources[rows]])
+    edge_rows = np.concatenate([rows, rows])
+    weights = relationships["weight"].fillna(0).to_numpy(dtype=np.float64)[edge_rows]
+    order = np.lexsort((-weights, owners))
+
+    indptr = np.zeros(len(entities) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owners, minlength=len(entities)), out=indptr[1:])
+    arrays = {
+        "node_ids": entities["human_readable_id"].to_numpy(),
+        "indptr": indptr,
+        "indices": neighbors[order].astype(np.int64),
+        "edge_rows": edge_rows[order].astype(np.int64),
+    }
+
+    # written next to the live index and swapped in, readers never see a half-built folder
+    folder = graph_index_dir(working_directory)
+    tmp_folder = f"{folder}.tmp"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_folder, f"{name}.npy"), array)
+    entities.to_parquet(os.path.join(tmp_folder, "nodes.parquet"), index=False)
+    relationships.to_parquet(os.path.join(tmp_folder, "edges.parquet"), index=False)
+    with open(os.path.join(tmp_folder, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "source_version": source_version(working_directory),
+            "nodes": len(entities),
+            "edges": len(rows),
+            "built": time.time(),
+        }, f, indent=2)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp_folder, folder)
+    return folder
+
+
+class GraphIndex:
+    # Read-only view of a built index. The arrays are memory-mapped, the node and edge rows are
+    # only read when records are asked for. Nodes are addressed by position, see positions().
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r"))
+        self._lock = threading.Lock()
+        self._nodes = None
+        self._edges = None
+        self._names = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    def node_table(self):
+        with self._lock:
+            if self._nodes is None:
+                self._nodes = pd.read_parquet(os.path.join(self.folder, "nodes.parquet"))
+                self._names = pd.Index(self._nodes["name"])
+            return self._nodes
+
+    def edge_table(self):
+        with self._lock:
+            if self._edges is None:
+                self._edges = pd.read_parquet(os.path.join(self.folder, "edges.parquet"))
+            return self._edges
+
+    def positions(self, ids):
+        # entity human_readable_ids -> node positions, unknown ids are dropped
+        ids = np.asarray([int(i) for i in ids], dtype=np.int64)
+        positions = np.searchsorted(self.node_ids, ids)
+        found = positions < self.num_nodes
+        found[found] = self.node_ids[positions[found]] == ids[found]
+        return positions[found]
+
+    def name_positions(self, names):
+        # entity names (titles) -> node positions, -1 for names that are not entities
+        self.node_table()
+        return self._names.get_indexer(list(names))
+
+    def positions_of(self, names):
+        # entity names (titles) -> node positions, unknown names are dropped
+        positions = self.name_positions(names)
+        return positions[positions >= 0]
+
+    def degree(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.indptr[positions + 1] - self.indptr[positions]
+
+    def _gather(self, frontier, max_degree=None, rng=None):
+        # (neighbor positions, edge rows) of every node in frontier, at most max_degree per node:
+        # the heaviest relationships, or a random subset when rng is given
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        if max_degree is not None and rng is None:
+            counts = np.minimum(counts, max_degree)
+        group_starts = np.cumsum(counts) - counts
+        entries = np.repeat(starts - group_starts, counts) + np.arange(counts.sum())
+        if max_degree is not None and rng is not None:
+            # random rank within each node's group, then keep the first max_degree ranks
+            owners = np.repeat(np.arange(len(frontier)), counts)
+            order = np.lexsort((rng.random(len(entries)), owners))
+            rank = np.arange(len(entries)) - np.repeat(group_starts, counts)
+            entries = entries[order][rank < max_degree]
+        return self.indices[entries], self.edge_rows[entries]
+
+    def _expand(self, seeds, hops, max_degree, max_nodes, rng):
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        visited[seeds] = True
+        nodes, edges = [seeds], []
+        frontier, total = seeds, len(seeds)
+        for _ in range(hops):
+            if len(frontier) == 0 or (max_nodes is not None and total >= max_nodes):
+                break
+            neighbors, rows = self._gather(frontier, max_degree, rng)
+            # first occurrence of each unseen neighbor, in gather order (heaviest edges first)
+            candidates = neighbors[~visited[neighbors]]
+            _, first = np.unique(candidates, return_index=True)
+            fresh = candidates[np.sort(first)]
+            if max_nodes is not None:
+                fresh = fresh[:max_nodes - total]
+            visited[fresh] = True
+            keep = visited[neighbors]
+            edges.append(rows[keep])
+            nodes.append(fresh)
+            frontier, total = fresh, total + len(fresh)
+        return np.concatenate(nodes), np.unique(np.concatenate(edges)) if edges else np.zeros(0, dtype=np.int64)
+
+    def k_hop(self, seeds, hops=1, max_degree=None, max_nodes=None):
+        # (node positions, edge rows) within `hops` of the seed positions; max_degree keeps only
+        # the heaviest relationships of each expanded node
+        return self._expand(seeds, hops, max_degree, max_nodes, None)
+
+    def sample(self, seeds, hops=2, max_degree=10, max_nodes=None, seed=None):
+        # like k_hop, but each expanded node contributes a random max_degree of its neighbors
+        return self._expand(seeds, hops, max_degree, max_nodes, np.random.default_rng(seed))
+
+    def shortest_path(self, source, target, max_hops=6):
+        # (node positions, edge rows) of a shortest unweighted path, None if none within max_hops
+        parent = np.full(self.num_nodes, -1, dtype=np.int64)
+        via = np.full(self.num_nodes, -1, dtype=np.int64)
+        parent[source] = source
+        frontier = np.array([source], dtype=np.int64)
+        for _ in range(max_hops):
+            if parent[target] >= 0 or len(frontier) == 0:
+                break
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            entries = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+            neighbors = self.indices[entries]
+            fresh, first = np.unique(neighbors, return_index=True)
+            unseen = parent[fresh] < 0
+            fresh, first = fresh[unseen], first[unseen]
+            parent[fresh] = np.repeat(frontier, counts)[first]
+            via[fresh] = self.edge_rows[entries[first]]
+            frontier = fresh
+        if parent[target] < 0:
+            return None
+        nodes, edges = [target], []
+        while nodes[-1] != source:
+            edges.append(via[nodes[-1]])
+            nodes.append(parent[nodes[-1]])
+        return np.array(nodes[::-1], dtype=np.int64), np.array(edges[::-1], dtype=np.int64)
+
+    def records(self, positions, edge_rows):
+        # entity and relationship rows in the layout query_graph.build_graph takes
+        entities = self.node_table().iloc[np.asarray(positions, dtype=np.int64)]
+        relations = self.edge_table().iloc[np.asarray(edge_rows, dtype=np.int64)]
+        return entities.reset_index(drop=True), relations.reset_index(drop=True)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def load_graph_index(working_directory, build=True):
+    # the project's index, rebuilt first if it is missing or older than the parquet it came from;
+    # None when the project has not been indexed yet
+    if not all(os.path.exists(source_path(working_directory, name)) for name in SOURCE_TABLES):
+        return None
+    folder = graph_index_dir(working_directory)
+    version = source_version(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(folder)
+        if index is not None and index.meta["source_version"] == version:
+            return index
+        meta_path = os.path.join(folder, "meta.json")
+        stale = True
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stale = json.load(f)["source_version"] != version
+        if stale:
+            if not build:
+                return None
+            build_graph_index(working_directory)
+        _indexes[folder] = GraphIndex(folder)
+        return _indexes[folder]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a project's CSR adjacency index")
+    parser.add_argument("--root", default="./projects/Solana")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    folder = build_graph_index(args.root)
+    index = GraphIndex(folder)
+    print(f"{index.meta['nodes']} entities, {index.meta['edges']} relationships indexed into {folder} "
+          f"in {time.perf_counter() - start:.2f}s")
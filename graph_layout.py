@@ -0,0 +1,130 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from graph_index import load_graph_index
+
+LAYOUT_FILE = "layout.npy"
+
+ITERATIONS = 60
+# the repulsion grid has at most GRID_SIZE x GRID_SIZE cells, so one step costs O(cells^2 + nodes + edges)
+GRID_SIZE = 32
+GRAVITY = 0.05
+SEED = 42
+
+# pixels per unit of sqrt(node count) when a subgraph is scaled onto the canvas
+CANVAS_SCALE = 120
+
+_lock = threading.Lock()
+
+
+def spring_layout(indptr, indices, iterations=ITERATIONS, seed=SEED):
+    # Fruchterman-Reingold on the CSR adjacency. Attraction runs along every edge; repulsion is
+    # approximated Barnes-Hut style on one grid level: whole cells push on each other through their
+    # centroids, and nodes inside a cell are pushed off their cell's centroid.
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    n = len(indptr) - 1
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    if n < 2:
+        return pos
+    k = 1 / np.sqrt(n)
+    owners = np.repeat(np.arange(n), np.diff(indptr))
+    temperature = 0.1
+
+    for step in range(iterations):
+        lo = pos.min(axis=0)
+        span = np.maximum(pos.max(axis=0) - lo, 1e-9)
+        grid = int(min(GRID_SIZE, max(1, np.sqrt(n / 4))))
+        cell_xy = np.minimum(((pos - lo) / span * grid).astype(np.int64), grid - 1)
+        cells = cell_xy[:, 0] * grid + cell_xy[:, 1]
+        mass = np.bincount(cells, minlength=grid * grid).astype(np.float64)
+        occupied = np.flatnonzero(mass)
+        centroid = np.zeros((grid * grid, 2))
+        for axis in range(2):
+            centroid[occupied, axis] = np.bincount(cells, weights=pos[:, axis], minlength=grid * grid)[occupied]
+        centroid[occupied] /= mass[occupied, None]
+
+        # cell-to-cell repulsion k^2 / d, weighted by the pushing cell's mass
+        delta = centroid[occupied, None, :] - centroid[None, occupied, :]
+        dist2 = np.maximum((delta ** 2).sum(axis=2), (k * 0.01) ** 2)
+        np.fill_diagonal(dist2, np.inf)
+        cell_force = np.zeros((grid * grid, 2))
+        cell_force[occupied] = (delta * (k * k * mass[occupied][None, :] / dist2)[:, :, None]).sum(axis=1)
+        disp = cell_force[cells]
+
+        # within a cell, nodes are pushed away from the centroid of everything else in it
+        offset = pos - centroid[cells]
+        offset2 = np.maximum((offset ** 2).sum(axis=1), (k * 0.01) ** 2)
+        disp += offset * (k * k * (mass[cells] - 1) / offset2)[:, None]
+
+        # attraction d^2 / k along edges (each undirected edge is listed under both endpoints)
+        if len(indices):
+            edge_delta = pos[indices] - pos[owners]
+            edge_dist = np.sqrt((edge_delta ** 2).sum(axis=1))
+            pull = edge_delta * (edge_dist / k)[:, None]
+            for axis in range(2):
+                disp[:, axis] += np.bincount(owners, weights=pull[:, axis], minlength=n)
+
+        # weak pull to the middle keeps disconnected components from drifting off
+        disp -= GRAVITY * (pos - pos.mean(axis=0))
+
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-12)
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature = 0.1 * (1 - (step + 1) / iterations) + 1e-4
+
+    pos -= pos.mean(axis=0)
+    return pos / max(np.abs(pos).max(), 1e-12)
+
+
+def layout_path(graph_index):
+    return os.path.join(graph_index.folder, LAYOUT_FILE)
+
+
+def get_layout(graph_index):
+    # (nodes, 2) coordinates in [-1, 1], computed once per built index and kept next to it;
+    # a rebuilt index starts from an empty folder, so the layout never outlives its graph
+    path = layout_path(graph_index)
+    with _lock:
+        if not os.path.exists(path):
+            layout = spring_layout(graph_index.indptr, graph_index.indices)
+            np.save(f"{path}.tmp.npy", layout)
+            os.replace(f"{path}.tmp.npy", path)
+    return np.load(path, mmap_mode="r")
+
+
+def node_coordinates(graph_index, names):
+    # layout coordinates of entities by name, NaN rows for names the index doesn't know
+    layout = get_layout(graph_index)
+    positions = graph_index.name_positions(names)
+    coordinates = np.full((len(positions), 2), np.nan)
+    coordinates[positions >= 0] = layout[positions[positions >= 0]]
+    return coordinates
+
+
+def canvas_positions(coordinates):
+    # a subgraph's global coordinates rescaled so it fills the canvas whatever part of the graph it is
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    if len(coordinates) == 0:
+        return coordinates
+    centered = coordinates - (coordinates.min(axis=0) + coordinates.max(axis=0)) / 2
+    extent = max(np.abs(centered).max(), 1e-12)
+    return centered / extent * CANVAS_SCALE * np.sqrt(len(coordinates))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute a project's graph layout")
+    parser.add_argument("--root", default="./projects/Solana")
+    args = parser.parse_args()
+
+    graph_index = load_graph_index(args.root)
+    if os.path.exists(layout_path(graph_index)):
+        os.remove(layout_path(graph_index))
+    start = time.perf_counter()
+    get_layout(graph_index)
+    print(f"Layout of {graph_index.num_nodes} entities written to {layout_path(graph_index)} "
+          f"in {time.perf_counter() - start:.2f}s")
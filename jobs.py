@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# how many graphrag index / prompt-tune / update runs may execute at once
+MAX_CONCURRENT_JOBS = 2
+
+JOBS_DIR = ".jobs"
+ACTIVE_STATUSES = ("queued", "running")
+
+# default graphrag index workflows, in the order they run
+INDEX_WORKFLOWS = [
+    "create_base_text_units",
+    "create_final_documents",
+    "create_base_entity_graph",
+    "create_final_entities",
+    "create_final_nodes",
+    "create_final_communities",
+    "create_final_relationships",
+    "create_final_text_units",
+    "create_final_community_reports",
+    "generate_text_embeddings",
+]
+
+# graphrag logs "dependencies for <workflow>: [...]" as each workflow starts
+WORKFLOW_START_PATTERN = re.compile(r"dependencies for (\w+)")
+
+
+def build_command(kind, working_directory, **options):
+    if kind == "index":
+        return ["graphrag", "index", "--root", working_directory]
+    if kind == "update":
+        return ["graphrag", "update", "--root", working_directory]
+    if kind == "prompt-tune":
+        return [
+            "graphrag", "prompt-tune",
+            "--root", working_directory,
+            "--domain", options["domain"],
+            "--chunk-size", str(options["chunk_size"]),
+        ]
+    raise ValueError(f"Unknown job kind: {kind}")
+
+
+def jobs_dir(working_directory):
+    return os.path.join(working_directory, JOBS_DIR)
+
+
+def engine_log_path(working_directory):
+    return os.path.join(working_directory, "logs", "indexing-engine.log")
+
+
+def parse_progress(log_text):
+    # fraction of workflows started plus the name of the current one
+    started = [name for name in WORKFLOW_START_PATTERN.findall(log_text) if name in INDEX_WORKFLOWS]
+    if not started:
+        return 0.0, None
+    done = len(dict.fromkeys(started)) - 1
+    return done / len(INDEX_WORKFLOWS), started[-1]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+class JobManager:
+    # Runs graphrag CLI jobs in the background with a bounded worker pool. Job state is
+    # written to <project>/.jobs/<id>.json so it survives Streamlit reruns and restarts.
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="graphrag-job")
+        # re-entrant: submit() lists the project's jobs (which takes the lock) while holding it
+        self._lock = threading.RLock()
+        self._jobs = {}
+        self._futures = {}
+        self._processes = {}
+        self._callbacks = {}
+
+    def _state_path(self, working_directory, job_id):
+        return os.path.join(jobs_dir(working_directory), f"{job_id}.json")
+
+    def _save(self, job):
+        path = self._state_path(job["working_directory"], job["id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _update(self, job, **changes):
+        with self._lock:
+            job.update(changes)
+            self._save(job)
+
+    def submit(self, kind, working_directory, on_success=None, **options):
+        command = build_command(kind, working_directory, **options)
+        # one active job per project, two index runs on the same output folder would clash; checked
+        # and registered under one lock so two sessions clicking at once can't both get through
+        with self._lock:
+            active = [job for job in self.list_jobs(working_directory) if job["status"] in ACTIVE_STATUSES]
+            if active:
+                raise RuntimeError(f"Project already has a {active[0]['kind']} job {active[0]['status']}.")
+            job = self._new_job(kind, working_directory, command)
+            self._save(job)
+            self._jobs[job["id"]] = job
+            self._callbacks[job["id"]] = on_success
+            self._futures[job["id"]] = self._executor.submit(self._run, job)
+        return job
+
+    def _new_job(self, kind, working_directory, command):
+        os.makedirs(jobs_dir(working_directory), exist_ok=True)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{uuid.uuid4().hex[:6]}"
+        engine_log = engine_log_path(working_directory)
+        return {
+            "id": job_id,
+            "kind": kind,
+            "working_directory": working_directory,
+            "command": command,
+            "status": "queued",
+            "progress": 0.0,
+            "stage": None,
+            "pid": None,
+            "returncode": None,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "log_path": os.path.join(jobs_dir(working_directory), f"{job_id}.log"),
+            # only the part of the engine log written after this offset belongs to the job
+            "engine_log_offset": os.path.getsize(engine_log) if os.path.exists(engine_log) else 0,
+        }
+
+    def _run(self, job):
+        if job["status"] == "cancelled":
+            return
+        try:
+            with open(job["log_path"], "w", encoding="utf-8") as log:
+                proc = subprocess.Popen(
+                    job["command"], stdout=log, stderr=subprocess.STDOUT, text=True
+                )
+                with self._lock:
+                    self._processes[job["id"]] = proc
+                self._update(job, status="running", pid=proc.pid, started=time.time())
+                while proc.poll() is None:
+                    time.sleep(1)
+                    self._refresh_progress(job)
+        except Exception as e:
+            self._update(job, status="failed", error=str(e), finished=time.time())
+            return
+        finally:
+            with self._lock:
+                self._processes.pop(job["id"], None)
+
+        if job["status"] == "cancelled":
+            self._update(job, returncode=proc.returncode, finished=time.time())
+            return
+        if proc.returncode != 0:
+            self._update(job, status="failed", returncode=proc.returncode, finished=time.time())
+            return
+
+        on_success = self._callbacks.pop(job["id"], None)
+        try:
+            if on_success is not None:
+                on_success(job)
+        except Exception as e:
+            self._update(job, status="failed", returncode=0, error=f"Post-processing failed: {e}", finished=time.time())
+            return
+        self._update(job, status="succeeded", returncode=0, progress=1.0, finished=time.time())
+
+    def _refresh_progress(self, job):
+        if job["kind"] == "prompt-tune":
+            return
+        engine_log = engine_log_path(job["working_directory"])
+        if not os.path.exists(engine_log):
+            return
+        with open(engine_log, "r", encoding="utf-8", errors="replace") as f:
+            f.seek(job["engine_log_offset"])
+            progress, stage = parse_progress(f.read())
+        if (progress, stage) != (job["progress"], job["stage"]):
+            self._update(job, progress=progress, stage=stage)
+
+    def cancel(self, working_directory, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return False
+        with self._lock:
+            future = self._futures.get(job_id)
+            proc = self._processes.get(job_id)
+        if future is not None and future.cancel():
+            self._update(job, status="cancelled", finished=time.time())
+            return True
+        if proc is not None:
+            self._update(job, status="cancelled")
+            proc.terminate()
+            return True
+        return False
+
+    def get_job(self, working_directory, job_id):
+        with self._lock:
+            if job_id in self._jobs:
+                return dict(self._jobs[job_id])
+        path = self._state_path(working_directory, job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            job = json.load(f)
+        if job["status"] in ACTIVE_STATUSES and not _pid_alive(job["pid"]):
+            # left behind by an earlier server process that is gone
+            job.update(status="lost", finished=job["finished"] or time.time())
+            self._save(job)
+        return job
+
+    def list_jobs(self, working_directory):
+        folder = jobs_dir(working_directory)
+        if not os.path.isdir(folder):
+            return []
+        job_ids = [name[:-len(".json")] for name in os.listdir(folder) if name.endswith(".json")]
+        jobs = [self.get_job(working_directory, job_id) for job_id in job_ids]
+        return sorted((job for job in jobs if job), key=lambda job: job["created"], reverse=True)
+
+    def read_log(self, job, max_chars=5000):
+        if not os.path.exists(job["log_path"]):
+            return ""
+        with open(job["log_path"], "r", encoding="utf-8", errors="replace") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - max_chars))
+            return f.read()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    # shared by every Streamlit session in the server process
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,121 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+MANIFEST_FILE = ".manifest.json"
+
+
+def manifest_path(working_directory):
+    return os.path.join(working_directory, MANIFEST_FILE)
+
+
+def input_dir(working_directory):
+    return os.path.join(working_directory, "input")
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(working_directory):
+    # files: current input/ contents, indexed: input/ contents at the last successful index
+    path = manifest_path(working_directory)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"files": {}, "indexed": {}, "indexed_at": None}
+
+
+def save_manifest(working_directory, manifest):
+    path = manifest_path(working_directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def scan_inputs(working_directory, manifest=None):
+    # only files whose size or mtime moved get re-hashed
+    manifest = manifest or load_manifest(working_directory)
+    folder = input_dir(working_directory)
+    files = {}
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            known = manifest["files"].get(name)
+            if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+                files[name] = known
+                continue
+            with open(path, "rb") as f:
+                digest = content_hash(f.read())
+            files[name] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    manifest["files"] = files
+    return manifest
+
+
+def save_uploads(working_directory, uploaded_files):
+    # writes new or changed uploads into input/, skipping content that is already there
+    manifest = scan_inputs(working_directory)
+    folder = input_dir(working_directory)
+    os.makedirs(folder, exist_ok=True)
+    known_hashes = {entry["sha256"] for entry in manifest["files"].values()}
+    saved, skipped = [], []
+    for uploaded_file in uploaded_files:
+        data = bytes(uploaded_file.getbuffer())
+        digest = content_hash(data)
+        if digest in known_hashes:
+            skipped.append(uploaded_file.name)
+            continue
+        path = os.path.join(folder, uploaded_file.name)
+        with open(path, "wb") as f:
+            f.write(data)
+        stat = os.stat(path)
+        manifest["files"][uploaded_file.name] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        known_hashes.add(digest)
+        saved.append(uploaded_file.name)
+    save_manifest(working_directory, manifest)
+    return saved, skipped
+
+
+def compute_delta(working_directory):
+    manifest = scan_inputs(working_directory)
+    save_manifest(working_directory, manifest)
+    current = {name: entry["sha256"] for name, entry in manifest["files"].items()}
+    indexed = manifest["indexed"]
+    return {
+        "added": sorted(name for name in current if name not in indexed),
+        "changed": sorted(name for name in current if name in indexed and indexed[name] != current[name]),
+        "removed": sorted(name for name in indexed if name not in current),
+        "snapshot": current,
+    }
+
+
+def plan_update(delta):
+    # graphrag update only picks up documents with new titles (file names); it cannot
+    # replace or retract documents, so edits and deletions need a full index run
+    if not (delta["added"] or delta["changed"] or delta["removed"]):
+        return None
+    if delta["changed"] or delta["removed"]:
+        return "index"
+    return "update"
+
+
+def promote_update_output(working_directory):
+    # graphrag update writes the merged tables to update_output/, queries read output/
+    update_folder = os.path.join(working_directory, "update_output")
+    output_folder = os.path.join(working_directory, "output")
+    for path in glob.glob(os.path.join(update_folder, "*.parquet")):
+        shutil.copy2(path, os.path.join(output_folder, os.path.basename(path)))
+
+
+def mark_indexed(working_directory, snapshot):
+    manifest = load_manifest(working_directory)
+    manifest["indexed"] = snapshot
+    manifest["indexed_at"] = time.time()
+    save_manifest(working_directory, manifest)
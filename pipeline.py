@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+
+import jsonlines
+import numpy as np
+from openai import AsyncOpenAI
+
+from batch_customized_eval import (
+    CONCURRENCY,
+    MAX_TOKENS,
+    MODEL,
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    TokenBucketLimiter,
+    build_messages,
+    end_with_newline,
+    input_hash,
+    judge,
+)
+from dataset_io import DATASET_COLUMNS, load_columns, system_name
+from metrics import METRIC_COLUMNS, score_datasets, score_rows
+from query_cache import get_query_cache, normalize_question
+from query_engine import get_engine
+from token_usage import BudgetExceeded, UsageTracker, truncate_text
+from tournament_eval import CRITERIA, DEFAULT_CACHE_FILE, load_judgments, load_responses, win_matrix, win_rates
+from tracing import DEFAULT_TRACE_PATH, span, trace, write_traces
+
+QUESTION_PATTERN = re.compile(r"- Question \d+: (.+)")
+
+# items a stage may hold before the stage feeding it has to wait
+QUEUE_SIZE = 64
+# answers scored together by one metrics pass
+METRICS_BATCH = 16
+
+DEFAULT_OUTPUT_DIR = "pipeline_output"
+
+
+def iter_questions(question_file):
+    # questions.txt is read line by line, so queries start before the whole set is parsed
+    with open(question_file, "r", encoding="utf-8") as f:
+        for line in f:
+            match = QUESTION_PATTERN.search(line)
+            if match:
+                yield match.group(1).strip()
+
+
+def load_references(path):
+    # normalized question -> reference passages, taken from an existing dataset file
+    data = load_columns(path, ["user_input", "reference"])
+    return {normalize_question(q): reference for q, reference in zip(data["user_input"], data["reference"])}
+
+
+def retrieved_contexts(context_data):
+    # the report and text unit bodies the answer was built from, as in dataset_*.json
+    context_data = context_data or {}
+    reports = [str(record["content"]) for record in context_data.get("reports", []) if record.get("content")]
+    sources = [str(record["text"]) for record in context_data.get("sources", []) if record.get("text")]
+    return reports + sources
+
+
+def load_rows(rows_file):
+    # (system, question index) -> dataset row from an earlier run; later lines win, a torn last line is ignored
+    rows = {}
+    if not os.path.exists(rows_file):
+        return rows
+    with open(rows_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "system" in record and "index" in record:
+                rows[(record.pop("system"), record.pop("index"))] = record
+    return rows
+
+
+async def answer(root, method, question, use_cache=True):
+    # (response, context records), from the shared query cache when the index hasn't changed
+    cache = get_query_cache()
+    if use_cache:
+        with span("cache_lookup") as attrs:
+            cached = cache.get(root, method, question)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return cached
+    response, context_data = await get_engine(root).aquery(method, question)
+    with span("cache_write"):
+        cache.put(root, method, question, str(response), context_data)
+    return str(response), context_data
+
+
+def failed_row(question, reference, error):
+    # stands in for an answer that could not be produced, so every dataset keeps one row per question;
+    # ok and error stay in rows.jsonl and summary.json, the dataset only gets the empty response
+    return {"user_input": question, "reference": reference, "response": "", "retrieved_contexts": [],
+            "ok": False, "error": error}
+
+
+def write_dataset(path, rows):
+    # rows in question order -> the dict-of-columns layout of dataset_*.json
+    data = {column: [row[column] for row in rows] for column in DATASET_COLUMNS}
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+async def arun_pipeline(question_file, root="./projects/Solana", methods=("drift",), output_dir=DEFAULT_OUTPUT_DIR,
+                        reference_file=None, baseline_files=(), workers=4, use_cache=True, evaluate=True,
+                        cache_file=DEFAULT_CACHE_FILE, api_key=None, base_url=None, rpm=REQUESTS_PER_MINUTE,
+                        tpm=TOKENS_PER_MINUTE, concurrency=CONCURRENCY, model=MODEL, trace_file=DEFAULT_TRACE_PATH,
+                        max_tokens=MAX_TOKENS, budget=None, max_answer_tokens=None):
+    # Questions -> queries -> (metrics, judge) as one stream. Every stage hands items on through a
+    # bounded queue, so scoring and judging run while later questions are still being answered,
+    # and a slow stage holds back the ones feeding it instead of piling answers up in memory.
+    os.makedirs(output_dir, exist_ok=True)
+    rows_file = os.path.join(output_dir, "rows.jsonl")
+    metrics_file = os.path.join(output_dir, "metrics.jsonl")
+    usage_file = os.path.join(output_dir, "usage.json")
+
+    methods = list(methods)
+    references = load_references(reference_file) if reference_file else {}
+    baselines = {system_name(path): load_responses(path) for path in baseline_files}
+    baselines = {name: responses for name, responses in baselines.items() if name not in methods}
+    systems = methods + list(baselines)
+    evaluate = evaluate and len(systems) > 1
+    if not evaluate:
+        print("Judging skipped, it needs at least two systems (methods or --baseline datasets)")
+
+    # answers from an earlier run are reused as long as the question at that index is unchanged,
+    # and the judge spend recorded by that run counts against the budget
+    resuming = os.path.exists(rows_file)
+    done = load_rows(rows_file)
+    judgments = load_judgments(cache_file)
+    usage = UsageTracker(model, budget)
+    if resuming:
+        usage.load(usage_file)
+
+    jobs = asyncio.Queue(QUEUE_SIZE)
+    answers = asyncio.Queue(QUEUE_SIZE)
+    to_score = asyncio.Queue(QUEUE_SIZE)
+    to_judge = asyncio.Queue(QUEUE_SIZE)
+
+    traces = []
+    comparisons = []
+    queued = set()
+    stats = {"questions": 0, "answered": 0, "reused": 0, "failed": 0, "judged": 0, "skipped": 0}
+
+    async def produce():
+        for index, question in enumerate(iter_questions(question_file)):
+            stats["questions"] += 1
+            for method in methods:
+                row = done.get((method, index))
+                # failed answers are asked again
+                if row is not None and row["user_input"] == question and row.get("ok", True):
+                    stats["reused"] += 1
+                    await answers.put((method, index, question, row, False))
+                else:
+                    await jobs.put((method, index, question))
+        for _ in range(workers):
+            await jobs.put(None)
+
+    async def query_worker():
+        while (job := await jobs.get()) is not None:
+            method, index, question = job
+            reference = references.get(normalize_question(question), [])
+            with trace("query", question=question, method=method, root=root) as query_trace:
+                try:
+                    response, context_data = await answer(root, method, question, use_cache)
+                    row = {
+                        "user_input": question,
+                        "reference": reference,
+                        "response": response,
+                        "retrieved_contexts": retrieved_contexts(context_data),
+                    }
+                except Exception as e:
+                    print(f"---------------------- {method} question {index + 1} Fail: {e} ----------------------")
+                    row = failed_row(question, reference, str(e))
+                query_trace.attrs["ok"] = row.get("ok", True)
+            traces.append(query_trace)
+            stats["answered" if row.get("ok", True) else "failed"] += 1
+            await answers.put((method, index, question, row, True))
+
+    async def dispatch(writer):
+        # fans each answer out to the metrics and judge stages; comparisons for a question are
+        # queued once every method has answered it
+        waiting = {}
+        while (item := await answers.get()) is not None:
+            method, index, question, row, fresh = item
+            ok = row.get("ok", True)
+            if fresh:
+                writer.write({"system": method, "index": index, **row})
+            if ok:
+                await to_score.put((method, index, row))
+            if not evaluate:
+                continue
+            slot = waiting.setdefault(index, {})
+            slot[method] = row if ok else None
+            if len(slot) < len(methods):
+                continue
+            del waiting[index]
+            responses = {name: row["response"] for name, row in slot.items() if row is not None}
+            for name, baseline in baselines.items():
+                if question in baseline:
+                    responses[name] = baseline[question]
+            if max_answer_tokens:
+                # before hashing, as in tournament_eval, so cached judgments match the truncated prompt
+                responses = {name: truncate_text(response, max_answer_tokens, model) for name, response in responses.items()}
+            # both orderings, like tournament_eval, so position bias cancels out
+            for first, second in itertools.permutations([name for name in systems if name in responses], 2):
+                answer1, answer2 = responses[first], responses[second]
+                key = input_hash(model, question, answer1, answer2)
+                comparisons.append({"systems": (first, second), "input_hash": key})
+                if key not in judgments and key not in queued:
+                    queued.add(key)
+                    await to_judge.put((key, question, (first, second), answer1, answer2))
+        await to_score.put(None)
+        if evaluate:
+            for _ in range(concurrency):
+                await to_judge.put(None)
+
+    async def score(writer):
+        # drains whatever is waiting (up to METRICS_BATCH) into one vectorised metrics pass
+        finished = False
+        while not finished:
+            item = await to_score.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < METRICS_BATCH and not to_score.empty():
+                item = to_score.get_nowait()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            scores = await asyncio.to_thread(
+                score_rows,
+                [row["reference"] for _, _, row in batch],
+                [row["response"] for _, _, row in batch],
+                [row["retrieved_contexts"] for _, _, row in batch],
+            )
+            for (method, index, _), values in zip(batch, scores.to_dict("records")):
+                writer.write({"system": method, "index": index, **values})
+
+    async def judge_worker(client, limiter, writer):
+        while (item := await to_judge.get()) is not None:
+            key, question, pair, answer1, answer2 = item
+            try:
+                evaluation = await judge(client, limiter, build_messages(question, answer1, answer2), model, max_tokens,
+                                         usage=usage, labels={"systems": list(pair)})
+            except BudgetExceeded as e:
+                print(f"Skipped {pair[0]} vs {pair[1]} on '{question}': {e}")
+                stats["skipped"] += 1
+                continue
+            except Exception as e:
+                print(f"Failed to judge {pair[0]} vs {pair[1]} on '{question}' after retries: {e}")
+                continue
+            judgments[key] = evaluation
+            stats["judged"] += 1
+            # same record layout as tournament_eval's cache, so a later tournament reuses them
+            writer.write({"input_hash": key, "question": question, "systems": list(pair), "evaluation": evaluation})
+
+    async def run_queries():
+        await asyncio.gather(produce(), *(query_worker() for _ in range(workers)))
+        await answers.put(None)
+
+    for path in (rows_file, metrics_file, cache_file):
+        end_with_newline(path)
+    try:
+        with jsonlines.open(rows_file, mode="a", flush=True) as rows_writer, \
+                jsonlines.open(metrics_file, mode="a", flush=True) as metrics_writer, \
+                jsonlines.open(cache_file, mode="a", flush=True) as judge_writer:
+            stages = [run_queries(), dispatch(rows_writer), score(metrics_writer)]
+            if evaluate:
+                client = AsyncOpenAI(
+                    api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+                    base_url=base_url or os.environ.get("OPENAI_BASE_URL"),
+                    max_retries=0,
+                )
+                limiter = TokenBucketLimiter(rpm, tpm)
+                stages += [judge_worker(client, limiter, judge_writer) for _ in range(concurrency)]
+            await asyncio.gather(*stages)
+    finally:
+        # written even when interrupted, so a resumed run knows what was already spent
+        usage.write(usage_file)
+
+    write_traces(traces, trace_file)
+
+    # the datasets are rebuilt in question order from the appended rows, the latest answer wins;
+    # every method gets one row per question so datasets line up by position
+    rows = load_rows(rows_file)
+    dataset_files = []
+    ok = []
+    failed_answers = {}
+    for method in methods:
+        path = os.path.join(output_dir, f"dataset_{method}.json")
+        method_rows = [
+            rows.get((method, i)) or failed_row(question, references.get(normalize_question(question), []), "not answered")
+            for i, question in enumerate(iter_questions(question_file))
+        ]
+        write_dataset(path, method_rows)
+        dataset_files.append(path)
+        ok += [row.get("ok", True) for row in method_rows]
+        failed_answers[method] = [
+            {"index": i, "question": row["user_input"], "error": row.get("error")}
+            for i, row in enumerate(method_rows) if not row.get("ok", True)
+        ]
+
+    # the streamed scores use an idf over each batch; the final table shares it across every system like
+    # metrics.py. Failed answers keep their row but get no scores, so they don't pull the means down
+    scores = score_datasets(dataset_files)
+    ok = np.array(ok, dtype=bool)
+    scores.insert(2, "ok", ok)
+    scores.loc[~ok, METRIC_COLUMNS] = np.nan
+    scores.to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+
+    result = {**stats, "systems": systems, "datasets": dataset_files, "failed_answers": failed_answers,
+              "usage": usage.summary()}
+    if evaluate:
+        matrix = win_matrix(systems, comparisons, judgments)
+        result.update(
+            comparisons=len(comparisons),
+            win_matrix=matrix,
+            win_rate={criterion: win_rates(matrix[criterion]) for criterion in CRITERIA},
+        )
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{stats['questions']} questions, {stats['answered']} answered, {stats['reused']} reused, "
+          f"{stats['failed']} failed, {stats['judged']} newly judged, {stats['skipped']} skipped by the budget")
+    print(usage.format_summary())
+    if len(scores):
+        print(scores.groupby("system", sort=False)[METRIC_COLUMNS].mean().round(4).to_string())
+    if evaluate:
+        print("Overall win rate: " + ", ".join(
+            f"{name} {rate:.2%}" for name, rate in result["win_rate"]["Overall Winner"].items()
+        ))
+    print(f"Datasets, metrics and summary are written to {output_dir}")
+    return result
+
+
+def run_pipeline(question_file, **kwargs):
+    return asyncio.run(arun_pipeline(question_file, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer the question set and evaluate the answers in one streaming run")
+    parser.add_argument("--questions", default="questions.txt")
+    parser.add_argument("--root", default="./projects/Solana")
+    parser.add_argument("--methods", nargs="+", default=["drift"], choices=["local", "global", "drift"])
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--reference", default=None, help="dataset file the reference answers are taken from")
+    parser.add_argument("--baseline", nargs="*", default=[], help="dataset files of other systems to judge against")
+    parser.add_argument("--workers", type=int, default=4, help="number of queries to run concurrently")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached answers and query again")
+    parser.add_argument("--no-judge", action="store_true", help="only compute the local metrics")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="judgment cache shared with tournament_eval.py")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE)
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--trace", default=DEFAULT_TRACE_PATH, help="JSONL file the per-query spans are appended to")
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="completion tokens allowed per judgment")
+    parser.add_argument("--budget", type=float, default=None, help="stop judging once this much USD could be spent")
+    parser.add_argument("--max-answer-tokens", type=int, default=None, help="truncate longer answers before judging")
+    args = parser.parse_args()
+
+    run_pipeline(
+        args.questions, root=args.root, methods=args.methods, output_dir=args.output_dir,
+        reference_file=args.reference, baseline_files=args.baseline, workers=max(1, args.workers),
+        use_cache=not args.no_cache, evaluate=not args.no_judge, cache_file=args.cache, rpm=args.rpm,
+        tpm=args.tpm, concurrency=max(1, args.concurrency), model=args.model, trace_file=args.trace,
+        max_tokens=args.max_tokens, budget=args.budget, max_answer_tokens=args.max_answer_tokens,
+    )
@@ -0,0 +1,139 @@
+import os
+import threading
+
+from manifest import input_dir, load_manifest, manifest_path
+
+DEFAULT_PROJECTS_PATH = os.path.join(os.getcwd(), "projects")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ProjectRegistry:
+    # Cached view of projects/ for the Streamlit pages, which rerun on every click. The project list,
+    # each project's metadata and each input/ listing are only rebuilt when the mtimes they depend on
+    # move, so a rerun costs a few stat calls instead of a walk over every project and file.
+
+    def __init__(self, projects_path=DEFAULT_PROJECTS_PATH):
+        self.projects_path = projects_path
+        self._lock = threading.Lock()
+        self._names = (None, [])
+        self._info = {}
+        self._files = {}
+
+    def project_dir(self, name):
+        return os.path.join(self.projects_path, name)
+
+    def project_names(self):
+        # creating or removing a project changes the mtime of projects/ itself
+        mtime = _mtime(self.projects_path)
+        with self._lock:
+            if self._names[0] != mtime:
+                names = []
+                if mtime is not None:
+                    with os.scandir(self.projects_path) as entries:
+                        names = sorted(entry.name for entry in entries if entry.is_dir())
+                self._names = (mtime, names)
+            return self._names[1]
+
+    def _signature(self, working_directory):
+        # input/ and output/ change when files come or go, the manifest on every upload and index,
+        # the engine log on every graphrag run (which may rewrite output files in place)
+        return (
+            _mtime(input_dir(working_directory)),
+            _mtime(os.path.join(working_directory, "output")),
+            _mtime(manifest_path(working_directory)),
+            _mtime(os.path.join(working_directory, "logs", "indexing-engine.log")),
+        )
+
+    def info(self, name):
+        working_directory = self.project_dir(name)
+        signature = self._signature(working_directory)
+        with self._lock:
+            cached = self._info.get(name)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        info = self._load_info(name, working_directory)
+        with self._lock:
+            self._info[name] = (signature, info)
+        return info
+
+    def _load_info(self, name, working_directory):
+        files = self._listing(working_directory)
+        artifacts = {}
+        output_folder = os.path.join(working_directory, "output")
+        if os.path.isdir(output_folder):
+            with os.scandir(output_folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".parquet"):
+                        artifacts[entry.name[:-len(".parquet")]] = entry.stat().st_mtime_ns
+
+        manifest = load_manifest(working_directory)
+        current = {file_name: entry["sha256"] for file_name, entry in manifest["files"].items()}
+        if "create_final_entities" not in artifacts:
+            status = "not indexed"
+        elif manifest["indexed"] and current != manifest["indexed"]:
+            status = "changes pending"
+        else:
+            status = "indexed"
+        last_indexed = manifest["indexed_at"]
+        if last_indexed is None and artifacts:
+            last_indexed = max(artifacts.values()) / 1e9
+
+        return {
+            "name": name,
+            "input_files": len(files),
+            "input_bytes": sum(size for _, size in files),
+            "status": status,
+            "last_indexed": last_indexed,
+            "artifacts": artifacts,
+        }
+
+    def _listing(self, working_directory):
+        # [(file name, size)] of input/, sorted by name and cached until input/ changes; uploads that
+        # overwrite a file keep the folder mtime but always rewrite the manifest
+        folder = input_dir(working_directory)
+        mtime = (_mtime(folder), _mtime(manifest_path(working_directory)))
+        with self._lock:
+            cached = self._files.get(folder)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        files = []
+        if mtime[0] is not None:
+            with os.scandir(folder) as entries:
+                files = sorted((entry.name, entry.stat().st_size) for entry in entries if entry.is_file())
+        with self._lock:
+            self._files[folder] = (mtime, files)
+        return files
+
+    def input_files(self, working_directory, search="", offset=0, limit=50):
+        # one page of input/ files whose names contain `search` (case-insensitive), plus the match count
+        files = self._listing(working_directory)
+        if search:
+            needle = search.casefold()
+            files = [item for item in files if needle in item[0].casefold()]
+        return files[offset:offset + limit], len(files)
+
+    def search_projects(self, search="", offset=0, limit=50):
+        names = self.project_names()
+        if search:
+            needle = search.casefold()
+            names = [name for name in names if needle in name.casefold()]
+        return [self.info(name) for name in names[offset:offset + limit]], len(names)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_project_registry():
+    # shared by every Streamlit session in the server process
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ProjectRegistry()
+        return _registry
@@ -0,0 +1,204 @@
+import contextvars
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from query_cache import get_query_cache, normalize_question
+from query_engine import get_engine
+
+# how many searches may run at once across every Query page session
+MAX_CONCURRENT_QUERIES = int(os.environ.get("GRAPHRAG_UI_MAX_QUERIES", 4))
+
+
+class _Execution:
+    # One search shared by every session that asked the same question. Chunks are kept so a
+    # session that joins late still replays the answer from the start.
+
+    def __init__(self, key, root, method, question):
+        self.key = key
+        self.root = root
+        self.method = method
+        self.question = question
+        self.status = "queued"
+        self.chunks = []
+        self.context_data = None
+        self.error = None
+        self.cancelled = False
+        self.subscribers = 0
+        self.stream = None
+        self.future = None
+        self.condition = threading.Condition()
+
+
+class QueryBroker:
+    # Runs Query page searches for all sessions in the server process. Identical in-flight
+    # (project, method, question) requests share one execution, at most max_concurrent run at
+    # once and the rest wait in arrival order.
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_QUERIES):
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="graphrag-query")
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._queue = deque()
+
+    def submit(self, root, method, question):
+        root = os.path.abspath(root)
+        key = (root, method, normalize_question(question))
+        with self._lock:
+            execution = self._inflight.get(key)
+            coalesced = execution is not None
+            if execution is None:
+                execution = _Execution(key, root, method, question)
+                self._inflight[key] = execution
+                self._queue.append(execution)
+                # the first caller's trace also records the spans of the shared search
+                context = contextvars.copy_context()
+                execution.future = self._executor.submit(context.run, self._run, execution)
+            execution.subscribers += 1
+        return QueryTicket(self, execution, coalesced)
+
+    def position(self, execution):
+        # 1-based place in the waiting line, 0 once the search has started
+        with self._lock:
+            try:
+                return self._queue.index(execution) + 1
+            except ValueError:
+                return 0
+
+    def queue_length(self):
+        with self._lock:
+            return len(self._queue)
+
+    def _run(self, execution):
+        with self._lock:
+            # dropped from the line when its last subscriber left before it started
+            if execution.status != "queued":
+                return
+            self._queue.remove(execution)
+            execution.status = "running"
+        try:
+            # everyone may have given up while it was queued
+            if not execution.cancelled:
+                self._search(execution)
+        except Exception as e:
+            execution.error = e
+        finally:
+            self._release(execution)
+            with execution.condition:
+                execution.status = "done"
+                execution.condition.notify_all()
+
+    def _search(self, execution):
+        stream = get_engine(execution.root).stream(execution.method, execution.question)
+        execution.stream = stream
+        if execution.cancelled:
+            stream.cancel()
+        for chunk in stream:
+            with execution.condition:
+                execution.chunks.append(chunk)
+                execution.condition.notify_all()
+        execution.context_data = stream.context_data
+        if not stream.finished:
+            execution.cancelled = True
+            return
+        # written once here rather than by each waiting session
+        get_query_cache().put(
+            execution.root, execution.method, execution.question, "".join(execution.chunks), stream.context_data
+        )
+
+    def _release(self, execution):
+        with self._lock:
+            if self._inflight.get(execution.key) is execution:
+                del self._inflight[execution.key]
+
+    def _unsubscribe(self, execution):
+        # the search is only stopped once nobody is waiting for it any more
+        with self._lock:
+            execution.subscribers -= 1
+            abandoned = execution.subscribers == 0 and execution.status != "done"
+            if abandoned:
+                execution.cancelled = True
+                if self._inflight.get(execution.key) is execution:
+                    del self._inflight[execution.key]
+                if execution.status == "queued":
+                    # never started, so it leaves the line now and positions behind it move up
+                    self._queue.remove(execution)
+                    execution.status = "done"
+                    execution.future.cancel()
+        if abandoned and execution.stream is not None:
+            execution.stream.cancel()
+        # wakes the detached ticket's iterator too, which may be blocked on another thread
+        with execution.condition:
+            execution.condition.notify_all()
+
+
+class QueryTicket:
+    # One session's handle on a brokered search. Iterating yields the response chunks from the
+    # start, blocking until the search produces more; it mirrors QueryStream for the Query page.
+
+    def __init__(self, broker, execution, coalesced):
+        self.coalesced = coalesced
+        self._broker = broker
+        self._execution = execution
+        self._detached = False
+        self.response = ""
+
+    @property
+    def context_data(self):
+        return self._execution.context_data
+
+    @property
+    def cancelled(self):
+        return self._detached or self._execution.cancelled
+
+    @property
+    def finished(self):
+        return self.done() and not self.cancelled and self._execution.error is None
+
+    def position(self):
+        return self._broker.position(self._execution)
+
+    def __iter__(self):
+        execution = self._execution
+        seen = 0
+        try:
+            while True:
+                with execution.condition:
+                    while len(execution.chunks) == seen and execution.status != "done" and not self.cancelled:
+                        execution.condition.wait()
+                    chunks = execution.chunks[seen:]
+                    over = execution.status == "done" or self.cancelled
+                for chunk in chunks:
+                    self.response += chunk
+                    yield chunk
+                seen += len(chunks)
+                if self._detached or (over and seen == len(execution.chunks)):
+                    break
+        finally:
+            # the consumer went away early (e.g. a Streamlit rerun), stop waiting on its behalf
+            if not self.done():
+                self.cancel()
+        if execution.error is not None:
+            raise execution.error
+
+    def cancel(self):
+        if not self._detached:
+            self._detached = True
+            self._broker._unsubscribe(self._execution)
+
+    def done(self):
+        return self._detached or self._execution.status == "done"
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_query_broker():
+    # shared by every Streamlit session in the server process
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = QueryBroker()
+        return _broker
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from query_engine import index_version
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "query_cache.sqlite")
+
+MAX_ENTRIES = 10000
+MAX_BYTES = 512 * 1024 * 1024
+MAX_AGE_SECONDS = 30 * 24 * 3600
+
+
+def normalize_question(question):
+    return " ".join(question.casefold().split())
+
+
+def cache_key(project, version, method, question):
+    raw = "\n".join([project, version, method, normalize_question(question)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    # On-disk answer cache shared by the Query page and batch_queries.py. Entries are keyed by
+    # project, index version, method and normalized question, so re-indexing a project
+    # invalidates its answers; stale versions are purged on the next write.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, max_age=MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    project TEXT NOT NULL,
+                    index_version TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    context TEXT,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_project ON answers (project, index_version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        # a connection per call keeps the cache usable from Streamlit's script threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, root, method, question):
+        project = os.path.abspath(root)
+        key = cache_key(project, index_version(project), method, question)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, context, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.max_age:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        response, context, _ = row
+        return response, json.loads(context) if context else None
+
+    def put(self, root, method, question, response, context_data=None):
+        project = os.path.abspath(root)
+        version = index_version(project)
+        key = cache_key(project, version, method, question)
+        context = json.dumps(context_data, default=str) if context_data is not None else None
+        size = len(response.encode("utf-8")) + len(context or "")
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            # answers computed against an older index of this project can never be hit again
+            conn.execute("DELETE FROM answers WHERE project = ? AND index_version != ?", (project, version))
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, project, version, method, normalize_question(question), response, context, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM answers WHERE created < ?", (now - self.max_age,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # drop least recently used entries until both limits hold
+        for key, size in conn.execute("SELECT key, size FROM answers ORDER BY last_used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def invalidate(self, root):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE project = ?", (os.path.abspath(root),))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
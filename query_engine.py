@@ -0,0 +1,369 @@
+import asyncio
+import functools
+import hashlib
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from tracing import span
+
+SEARCH_LABELS = {"local": "Local", "global": "Global", "drift": "DRIFT"}
+
+# parquet tables each search method needs, mirroring `graphrag query`
+METHOD_TABLES = {
+    "local": [
+        "create_final_nodes",
+        "create_final_community_reports",
+        "create_final_text_units",
+        "create_final_relationships",
+        "create_final_entities",
+    ],
+    "global": [
+        "create_final_nodes",
+        "create_final_entities",
+        "create_final_communities",
+        "create_final_community_reports",
+    ],
+    "drift": [
+        "create_final_nodes",
+        "create_final_community_reports",
+        "create_final_text_units",
+        "create_final_relationships",
+        "create_final_entities",
+    ],
+}
+OPTIONAL_TABLES = {"local": ["create_final_covariates"], "global": [], "drift": []}
+
+
+def output_dir(root):
+    return os.path.join(root, "output")
+
+
+def index_version(root):
+    # fingerprint of the index artifacts, changes whenever graphrag rewrites the output folder
+    digest = hashlib.sha1()
+    folder = output_dir(root)
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".parquet"):
+                stat = os.stat(os.path.join(folder, name))
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def format_response(method, response):
+    # same shape as the "SUCCESS: ..." line printed by `graphrag query`
+    return f"SUCCESS:{SEARCH_LABELS[method]} Search Response:\n{str(response).strip()}"
+
+
+class QueryEngine:
+    # Loads a project's config, parquet tables and vector stores once and answers many
+    # questions against them. Everything is reloaded when the output folder or settings change.
+
+    def __init__(self, root, community_level=2, response_type="Multiple Paragraphs", dynamic_community_selection=False):
+        self.root = os.path.abspath(root)
+        self.community_level = community_level
+        self.response_type = response_type
+        self.dynamic_community_selection = dynamic_community_selection
+        self._lock = threading.Lock()
+        self._version = None
+        self._config = None
+        self._tables = {}
+        self._factories = {}
+
+    def _current_version(self):
+        settings = os.path.join(self.root, "settings.yaml")
+        settings_mtime = os.stat(settings).st_mtime_ns if os.path.exists(settings) else 0
+        return index_version(self.root), settings_mtime
+
+    def _refresh(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        # the first call also pays for importing graphrag
+        with span("config_load"):
+            from graphrag.config.load_config import load_config
+            from graphrag.config.resolve_path import resolve_paths
+
+            config = load_config(Path(self.root), None)
+            resolve_paths(config)
+        self._config = config
+        self._tables = {}
+        self._factories = {}
+        self._version = version
+
+    def _table(self, name, optional=False):
+        if name not in self._tables:
+            path = os.path.join(output_dir(self.root), f"{name}.parquet")
+            if optional and not os.path.exists(path):
+                self._tables[name] = None
+            else:
+                with span("parquet_read", table=name):
+                    self._tables[name] = pd.read_parquet(path)
+        return self._tables[name]
+
+    def load(self, method):
+        # returns a factory for a fresh search engine; the heavy inputs behind it are shared
+        with self._lock, span("index_load", method=method) as attrs:
+            self._refresh()
+            attrs["warm"] = method in self._factories
+            if method not in self._factories:
+                for name in METHOD_TABLES[method]:
+                    self._table(name)
+                for name in OPTIONAL_TABLES[method]:
+                    self._table(name, optional=True)
+                self._factories[method] = self._build_factory(method)
+            return self._factories[method]
+
+    def _build_factory(self, method):
+        from graphrag.api.query import (
+            _get_embedding_store,
+            _load_search_prompt,
+            _patch_vector_store,
+        )
+        from graphrag.index.config.embeddings import (
+            community_full_content_embedding,
+            entity_description_embedding,
+        )
+        from graphrag.query.factories import (
+            get_drift_search_engine,
+            get_global_search_engine,
+            get_local_search_engine,
+        )
+        from graphrag.query.indexer_adapters import (
+            read_indexer_communities,
+            read_indexer_covariates,
+            read_indexer_entities,
+            read_indexer_relationships,
+            read_indexer_report_embeddings,
+            read_indexer_reports,
+            read_indexer_text_units,
+        )
+        from graphrag.vector_stores.factory import VectorStoreType
+
+        config = self._config
+        level = self.community_level
+        nodes = self._tables["create_final_nodes"]
+        entities = self._tables["create_final_entities"]
+        community_reports = self._tables["create_final_community_reports"]
+
+        if method == "global":
+            reports = read_indexer_reports(
+                community_reports,
+                nodes,
+                community_level=level,
+                dynamic_community_selection=self.dynamic_community_selection,
+            )
+            return functools.partial(
+                get_global_search_engine,
+                config,
+                reports=reports,
+                entities=read_indexer_entities(nodes, entities, community_level=level),
+                communities=read_indexer_communities(
+                    self._tables["create_final_communities"], nodes, community_reports
+                ),
+                response_type=self.response_type,
+                dynamic_community_selection=self.dynamic_community_selection,
+                map_system_prompt=_load_search_prompt(config.root_dir, config.global_search.map_prompt),
+                reduce_system_prompt=_load_search_prompt(config.root_dir, config.global_search.reduce_prompt),
+                general_knowledge_inclusion_prompt=_load_search_prompt(
+                    config.root_dir, config.global_search.knowledge_prompt
+                ),
+            )
+
+        with_reports = community_reports if method == "drift" else None
+        config = _patch_vector_store(config, nodes, entities, level, with_reports=with_reports)
+        vector_store_args = config.embeddings.vector_store
+        if vector_store_args.get("type") == VectorStoreType.LanceDB:
+            vector_store_args["db_uri"] = str(Path(config.root_dir).resolve() / vector_store_args["db_uri"])
+        description_embedding_store = _get_embedding_store(
+            config_args=vector_store_args,
+            embedding_name=entity_description_embedding,
+        )
+        text_units = read_indexer_text_units(self._tables["create_final_text_units"])
+        relationships = read_indexer_relationships(self._tables["create_final_relationships"])
+        indexer_entities = read_indexer_entities(nodes, entities, level)
+
+        if method == "local":
+            covariates = self._tables["create_final_covariates"]
+            return functools.partial(
+                get_local_search_engine,
+                config=config,
+                reports=read_indexer_reports(community_reports, nodes, level),
+                text_units=text_units,
+                entities=indexer_entities,
+                relationships=relationships,
+                covariates={"claims": read_indexer_covariates(covariates) if covariates is not None else []},
+                description_embedding_store=description_embedding_store,
+                response_type=self.response_type,
+                system_prompt=_load_search_prompt(config.root_dir, config.local_search.prompt),
+            )
+
+        full_content_embedding_store = _get_embedding_store(
+            config_args=vector_store_args,
+            embedding_name=community_full_content_embedding,
+        )
+        reports = read_indexer_reports(community_reports, nodes, level)
+        read_indexer_report_embeddings(reports, full_content_embedding_store)
+        # DRIFT keeps per-query state on the engine, so a new one is built for every question
+        return functools.partial(
+            get_drift_search_engine,
+            config=config,
+            reports=reports,
+            text_units=text_units,
+            entities=indexer_entities,
+            relationships=relationships,
+            description_embedding_store=description_embedding_store,
+            local_system_prompt=_load_search_prompt(config.root_dir, config.drift_search.prompt),
+        )
+
+    def _context_records(self, context_data):
+        # the context the answer was built from as {"entities": [...], "relationships": [...], ...}
+        # record lists; record "id"s are the human_readable_ids the answer cites
+        from graphrag.api.query import _reformat_context_data
+
+        if context_data and all(isinstance(value, dict) for value in context_data.values()):
+            # DRIFT keys a local-search context by each follow-up query, merge them per record type
+            merged = {}
+            for local_context in context_data.values():
+                for key, df in local_context.items():
+                    if isinstance(df, pd.DataFrame) and not df.empty:
+                        merged.setdefault(key, []).append(df)
+            context_data = {
+                key: pd.concat(frames, ignore_index=True).drop_duplicates("id") for key, frames in merged.items()
+            }
+        records = _reformat_context_data(context_data)
+
+        # graphrag's entity records carry no type, fill it in from the table already in memory
+        entities = self._tables.get("create_final_entities")
+        if records["entities"] and entities is not None:
+            types = dict(zip(entities["human_readable_id"].astype(str), entities["type"]))
+            for record in records["entities"]:
+                record.setdefault("type", types.get(str(record["id"])))
+        return records
+
+    async def aquery(self, method, question):
+        search_engine = self.load(method)()
+        with span("llm_search", method=method) as attrs:
+            result = await search_engine.asearch(query=question)
+            # graphrag counts calls and tokens on the result, streaming searches don't report them
+            attrs.update(llm_calls=result.llm_calls, prompt_tokens=result.prompt_tokens, output_tokens=result.output_tokens)
+        response = result.response
+        if isinstance(response, dict):
+            # DRIFT returns one answer per follow-up node, graphrag reports the top one
+            response = response["nodes"][0]["answer"]
+        return response, self._context_records(result.context_data)
+
+    def query(self, method, question):
+        return asyncio.run(self.aquery(method, question))
+
+    async def astream(self, method, question):
+        # yields the context records first, then the response text chunk by chunk
+        if method == "drift":
+            # graphrag has no streaming DRIFT search, the whole answer arrives at once
+            response, context_data = await self.aquery(method, question)
+            yield context_data
+            yield response
+            return
+
+        search_engine = self.load(method)()
+        first = True
+        with span("llm_search", method=method, streamed=True) as attrs:
+            started = time.perf_counter()
+            async for chunk in search_engine.astream_search(query=question):
+                if first:
+                    attrs["context_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                    yield self._context_records(chunk)
+                    first = False
+                else:
+                    attrs.setdefault("first_token_ms", round((time.perf_counter() - started) * 1000, 3))
+                    yield chunk
+
+    def stream(self, method, question):
+        return QueryStream(self, method, question)
+
+
+_DONE = object()
+
+
+class QueryStream:
+    # Runs a streaming search on its own event loop thread. Iterating yields response
+    # chunks as they arrive; cancel() stops the search and its in-flight LLM requests.
+
+    def __init__(self, engine, method, question):
+        self.method = method
+        self.question = question
+        self.context_data = None
+        self.response = ""
+        self.error = None
+        self.cancelled = False
+        self.finished = False
+        self._queue = queue.Queue()
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._produce(engine))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    async def _produce(self, engine):
+        first = True
+        try:
+            async for chunk in engine.astream(self.method, self.question):
+                if first:
+                    self.context_data = chunk
+                    first = False
+                else:
+                    self._queue.put(chunk)
+        except asyncio.CancelledError:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+
+    def _run(self):
+        try:
+            self._loop.run_until_complete(self._task)
+        finally:
+            self._loop.close()
+            self._queue.put(_DONE)
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is _DONE:
+                    break
+                self.response += chunk
+                yield chunk
+        finally:
+            # the consumer went away early (e.g. a Streamlit rerun), don't leave the search running
+            if self._thread.is_alive():
+                self.cancel()
+        self.finished = not self.cancelled and self.error is None
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        try:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        except RuntimeError:
+            # loop already closed, the search has finished
+            pass
+
+    def done(self):
+        return not self._thread.is_alive()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(root):
+    # one warm engine per project root, shared by every caller in the process
+    root = os.path.abspath(root)
+    with _engines_lock:
+        if root not in _engines:
+            _engines[root] = QueryEngine(root)
+        return _engines[root]
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from pyvis.network import Network
+
+from graph_layout import canvas_positions
+from tracing import span
+
+# upper bound on what gets sent to the browser for one answer
+MAX_NODES = 300
+MAX_EDGES = 600
+
+DEFAULT_NODE_COLOR = "#97c2fc"
+
+# context record field -> column build_graph expects
+ENTITY_FIELDS = {"id": "human_readable_id", "entity": "name", "type": "type", "description": "description"}
+RELATIONSHIP_FIELDS = {"id": "human_readable_id", "source": "source", "target": "target", "description": "description"}
+
+
+def wrap_text(series, width=50):
+    # limit 50 characters per line
+    return series.fillna("").astype(str).str.wrap(width)
+
+
+def context_frame(records, fields):
+    # missing fields (e.g. type on answers cached before it was recorded) come back as NaN
+    return pd.DataFrame.from_records(records or [], columns=list(fields)).rename(columns=fields)
+
+
+def build_graph(entities, relations, max_nodes=MAX_NODES, max_edges=MAX_EDGES):
+    entities = entities.drop_duplicates("name")
+    truncated = len(entities) > max_nodes or len(relations) > max_edges
+    # cap before building the tooltips so oversized citation sets stay cheap
+    entities = entities.head(max_nodes)
+    types = entities["type"].fillna("").astype(str)
+    relations = relations.head(max_edges)
+
+    nodes = pd.DataFrame({
+        "id": entities["name"].astype(str),
+        "label": entities["name"].astype(str),  # show name in circle node
+        "title": (
+            "Name: " + entities["name"].astype(str)
+            + "\nType: " + types
+            + "\nDescription: " + wrap_text(entities["description"])
+        ),
+        "group": types,
+    })
+
+    # relationship endpoints that are not cited entities still need a node
+    endpoints = pd.Series(pd.unique(pd.concat([relations["source"], relations["target"]]).astype(str)))
+    endpoints = endpoints[~endpoints.isin(nodes["id"])]
+    nodes = pd.concat([
+        nodes,
+        pd.DataFrame({"id": endpoints, "label": endpoints, "title": endpoints, "color": DEFAULT_NODE_COLOR}),
+    ], ignore_index=True)
+
+    if len(nodes) > max_nodes:
+        truncated = True
+        nodes = nodes.head(max_nodes)
+        kept = relations["source"].astype(str).isin(nodes["id"]) & relations["target"].astype(str).isin(nodes["id"])
+        relations = relations[kept]
+
+    edges = pd.DataFrame({
+        "from": relations["source"].astype(str),
+        "to": relations["target"].astype(str),
+        "title": wrap_text(relations["description"]),
+        "arrows": "to",
+    })
+    return nodes, edges, truncated
+
+
+def place_nodes(nodes, edges, coordinates):
+    # fixed x/y from the project layout; nodes it doesn't know (NaN rows) sit at the mean of
+    # their placed neighbors, or at the middle of the graph when they have none
+    coordinates = np.array(coordinates, dtype=np.float64)
+    known = ~np.isnan(coordinates[:, 0])
+    if not known.any():
+        return nodes
+    index = pd.Index(nodes["id"])
+    ends = np.concatenate([index.get_indexer(edges["from"]), index.get_indexer(edges["to"])])
+    others = np.concatenate([index.get_indexer(edges["to"]), index.get_indexer(edges["from"])])
+    usable = (ends >= 0) & (others >= 0) & ~known[np.maximum(ends, 0)] & known[np.maximum(others, 0)]
+    counts = np.bincount(ends[usable], minlength=len(nodes))
+    for axis in range(2):
+        sums = np.bincount(ends[usable], weights=coordinates[others[usable], axis], minlength=len(nodes))
+        fill = ~known & (counts > 0)
+        coordinates[fill, axis] = sums[fill] / counts[fill]
+    missing = np.isnan(coordinates[:, 0])
+    coordinates[missing] = coordinates[known].mean(axis=0)
+
+    xy = canvas_positions(coordinates)
+    # nodes that landed on the same spot are fanned out slightly so none hides another
+    angles = np.arange((~known).sum())
+    xy[~known] += np.stack([np.cos(angles), np.sin(angles)], axis=1) * 25
+    return nodes.assign(x=xy[:, 0], y=xy[:, 1])
+
+
+def render_html(nodes, edges, height="750px"):
+    net = Network(height=height, width="100%", directed=True, cdn_resources="remote")
+    if "x" in nodes:
+        # positions are precomputed, the browser only draws; straight edges need no simulation either
+        net.toggle_physics(False)
+        net.options.edges.smooth.enabled = False
+        net.options.interaction.hideEdgesOnDrag = len(edges) > 1000
+    # assign the vis.js records in bulk, add_node/add_edge re-scan the node list on every call
+    net.nodes = [
+        {key: value for key, value in record.items() if not pd.isna(value)}
+        for record in nodes.assign(shape="dot").to_dict("records")
+    ]
+    net.node_ids = nodes["id"].tolist()
+    net.node_map = dict(zip(net.node_ids, net.nodes))
+    net.edges = edges.to_dict("records")
+    return net.generate_html()
+
+
+def generate_query_visulization(context_data, max_nodes=MAX_NODES, max_edges=MAX_EDGES, expansion=None, coordinates=None):
+    # the graph is built from the context records the answer was generated from, nothing is re-read;
+    # expansion is an optional (entities, relations) pair from the graph index, added after them, and
+    # coordinates an optional function from node names to layout positions
+    context_data = context_data or {}
+    with span("graph_build") as attrs:
+        entities = context_frame(context_data.get("entities"), ENTITY_FIELDS)
+        relations = context_frame(context_data.get("relationships"), RELATIONSHIP_FIELDS)
+        if expansion is not None:
+            entities = pd.concat([entities, expansion[0]], ignore_index=True)
+            relations = pd.concat([relations, expansion[1]], ignore_index=True)
+            relations = relations[~relations["human_readable_id"].astype(str).duplicated()]
+        nodes, edges, truncated = build_graph(entities, relations, max_nodes, max_edges)
+        attrs.update(nodes=len(nodes), edges=len(edges))
+    if coordinates is not None and len(nodes):
+        with span("graph_layout"):
+            nodes = place_nodes(nodes, edges, coordinates(nodes["id"]))
+    with span("pyvis_render"):
+        html = render_html(nodes, edges)
+    return html, truncated
@@ -0,0 +1,102 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from query_cache import normalize_question
+
+
+def parse_shard(value):
+    # "i/N" with 1 <= i <= N -> (i, N); also the argparse type of every --shard flag
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {value!r} is out of range, i must be between 1 and N")
+    return index, count
+
+
+def shard_of(question, count):
+    # 1-based shard of a question; a content hash, so every process and machine agrees on it
+    # whatever order or subset of questions it sees
+    digest = hashlib.sha256(normalize_question(question).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def select_shard(questions, shard):
+    # indices (into the full question list) of the questions that belong to shard
+    index, count = shard
+    return [i for i, question in enumerate(questions) if shard_of(question, count) == index]
+
+
+def shard_path(path, shard):
+    # output.txt -> output.shard-2-of-4.txt
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def shard_paths(path, count):
+    return [shard_path(path, (index, count)) for index in range(1, count + 1)]
+
+
+def gaps_path(path):
+    # where a merge writes what it re-ran for items no shard produced
+    root, ext = os.path.splitext(path)
+    return f"{root}.gaps{ext}"
+
+
+def read_records(path):
+    # JSON object per line; a torn last line from an interrupted shard is skipped
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict):
+                yield record
+
+
+def collect(paths, expected, field):
+    # index -> record across shard files. A record only counts if its `field` still matches
+    # expected[index] (same question / same judge inputs); later files win, except that a failed
+    # record never replaces a successful one. Returns (records, missing, duplicates, stale).
+    records, duplicates, stale = {}, 0, 0
+    for path in paths:
+        for record in read_records(path):
+            index = record.get("index")
+            if not isinstance(index, int) or not 0 <= index < len(expected) or record.get(field) != expected[index]:
+                stale += 1
+                continue
+            if index in records:
+                duplicates += 1
+                if records[index].get("ok", True) and not record.get("ok", True):
+                    continue
+            records[index] = record
+    missing = [index for index in range(len(expected)) if index not in records]
+    return records, missing, duplicates, stale
+
+
+if __name__ == "__main__":
+    # runs N shard processes of a batch script on this machine, then its merge step, e.g.
+    #   python sharding.py --shards 4 batch_queries.py --method local
+    parser = argparse.ArgumentParser(description="Run a batch script as N local shard processes and merge them")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("script", help="batch_queries.py or batch_customized_eval.py")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments passed to every shard")
+    args = parser.parse_args()
+
+    command = [sys.executable, args.script, *args.args]
+    processes = [
+        subprocess.Popen(command + ["--shard", f"{index}/{args.shards}"])
+        for index in range(1, args.shards + 1)
+    ]
+    failed = [index for index, process in enumerate(processes, 1) if process.wait() != 0]
+    if failed:
+        print(f"Shards {failed} exited with an error, the merge re-runs whatever they did not write")
+    sys.exit(subprocess.call(command + ["--merge", str(args.shards)]))
@@ -0,0 +1,231 @@
+import asyncio
+import functools
+import json
+import os
+
+try:
+    import tiktoken
+except ImportError:  # optional, counts fall back to 4 characters per token
+    tiktoken = None
+
+# USD per 1M (prompt, completion) tokens
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+CONTEXT_WINDOWS = {"gpt-4o": 128000, "gpt-4o-mini": 128000, "gpt-4-turbo": 128000, "gpt-3.5-turbo": 16385}
+
+# tokens the chat format adds around each message
+MESSAGE_OVERHEAD = 4
+FALLBACK_ENCODING = "o200k_base"
+# calls listed as the largest prompts in summaries
+TOP_PROMPTS = 5
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        name = tiktoken.model.encoding_name_for_model(model)
+    except KeyError:
+        name = FALLBACK_ENCODING
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # the encoding files are downloaded on first use, offline boxes fall back to the estimate
+        return None
+
+
+def count_tokens(text, model):
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model):
+    return sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD for message in messages)
+
+
+def truncate_text(text, max_tokens, model):
+    # the first max_tokens tokens plus a marker saying how much was cut; the same text always
+    # truncates the same way, so judgments of truncated answers stay cacheable
+    encoding = _encoding(model)
+    if encoding is None:
+        total = len(text) // 4
+        if total <= max_tokens:
+            return text
+        kept = text[:max_tokens * 4]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        total = len(tokens)
+        if total <= max_tokens:
+            return text
+        kept = encoding.decode(tokens[:max_tokens])
+    return f"{kept}\n\n[... truncated, {total - max_tokens} of {total} tokens omitted]"
+
+
+def call_cost(prices, prompt_tokens, completion_tokens):
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6
+
+
+def preflight(prompts, model, max_tokens, rpm=None, tpm=None, prices=None):
+    # local estimate for a list of (label, messages) before anything is sent: token totals,
+    # worst-case cost (every reply using max_tokens), prompts that don't fit the context window
+    # and the shortest time the rate limits allow
+    prices = prices or PRICES.get(model)
+    sizes = [(label, count_message_tokens(messages, model)) for label, messages in prompts]
+    prompt_tokens = sum(size for _, size in sizes)
+    completion_tokens = max_tokens * len(sizes)
+    window = CONTEXT_WINDOWS.get(model)
+    minutes = []
+    if rpm:
+        minutes.append(len(sizes) / rpm)
+    if tpm:
+        minutes.append((prompt_tokens + completion_tokens) / tpm)
+    return {
+        "calls": len(sizes),
+        "prompt_tokens": prompt_tokens,
+        "max_completion_tokens": completion_tokens,
+        "mean_prompt_tokens": prompt_tokens / len(sizes) if sizes else 0,
+        "max_cost": call_cost(prices, prompt_tokens, completion_tokens),
+        "min_minutes": max(minutes) if minutes else None,
+        "over_context": [label for label, size in sizes if window and size + max_tokens > window],
+        "largest": sorted(sizes, key=lambda item: -item[1])[:TOP_PROMPTS],
+    }
+
+
+def format_preflight(estimate):
+    lines = [
+        f"Pre-flight: {estimate['calls']} calls, {estimate['prompt_tokens']} prompt tokens "
+        f"(mean {estimate['mean_prompt_tokens']:.0f}), at most {estimate['max_completion_tokens']} completion tokens"
+    ]
+    if estimate["max_cost"] is not None:
+        lines.append(f"  worst-case cost ${estimate['max_cost']:.4f}")
+    if estimate["min_minutes"] is not None:
+        lines.append(f"  rate limits allow it in no less than {estimate['min_minutes']:.1f} min")
+    if estimate["over_context"]:
+        lines.append(f"  {len(estimate['over_context'])} prompt(s) exceed the context window: {estimate['over_context'][:10]}")
+    lines.append("  largest prompts: " + ", ".join(f"{label} ({size})" for label, size in estimate["largest"]))
+    return "\n".join(lines)
+
+
+def read_calls(path):
+    # the per-call records of a usage file written by UsageTracker.write, [] when there is none
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return list(json.load(f).get("calls", []))
+    except (OSError, json.JSONDecodeError, AttributeError, TypeError):
+        print(f"Warning: could not read earlier usage from {path}, it is left out")
+        return []
+
+
+class UsageTracker:
+    # Token counts and cost of every judge call, from response.usage, aggregated for the run and
+    # per system. With a budget (USD), each call first reserves its worst case (prompt estimate plus
+    # max_tokens). A call that doesn't fit waits while other calls are in flight, since they usually
+    # cost less than reserved; once only settled spend is left and it still doesn't fit, it raises
+    # BudgetExceeded. Spend loaded from an earlier run counts against the budget too.
+
+    def __init__(self, model, budget=None, prices=None):
+        self.model = model
+        self.budget = budget
+        self.prices = prices or PRICES.get(model)
+        if budget is not None and self.prices is None:
+            raise ValueError(f"No price known for {model}, a budget needs one")
+        self.calls = []
+        self.spent = 0.0
+        self.reserved = 0.0
+        self._in_flight = 0
+        self._settled = asyncio.Condition()
+
+    async def reserve(self, prompt_tokens, max_tokens):
+        if self.budget is None:
+            return 0.0
+        amount = call_cost(self.prices, prompt_tokens, max_tokens)
+        async with self._settled:
+            while self.spent + self.reserved + amount > self.budget:
+                if not self._in_flight:
+                    raise BudgetExceeded(f"budget of ${self.budget:.4f} exhausted (${self.spent:.4f} spent)")
+                await self._settled.wait()
+            self.reserved += amount
+            self._in_flight += 1
+        return amount
+
+    async def release(self, amount):
+        if not amount:
+            return
+        async with self._settled:
+            self._in_flight -= 1
+            # summed floats drift, nothing reserved has to mean exactly zero
+            self.reserved = self.reserved - amount if self._in_flight else 0.0
+            self._settled.notify_all()
+
+    def record(self, usage, estimated_prompt_tokens, labels=None):
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        cost = call_cost(self.prices, prompt_tokens, completion_tokens)
+        self.spent += cost or 0.0
+        self.calls.append({
+            **(labels or {}),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated_prompt_tokens": estimated_prompt_tokens,
+            "cost": cost,
+        })
+
+    def _totals(self, calls):
+        prompt_tokens = sum(call["prompt_tokens"] for call in calls)
+        estimated = sum(call["estimated_prompt_tokens"] for call in calls)
+        return {
+            "calls": len(calls),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "cost": sum(call["cost"] or 0.0 for call in calls) if self.prices else None,
+            # how far the local estimate was off, > 1 means the estimate was too low
+            "estimate_ratio": prompt_tokens / estimated if estimated else None,
+        }
+
+    def summary(self):
+        systems = {}
+        for call in self.calls:
+            for system in call.get("systems", []):
+                systems.setdefault(system, []).append(call)
+        return {
+            "model": self.model,
+            "budget": self.budget,
+            "run": self._totals(self.calls),
+            "systems": {system: self._totals(calls) for system, calls in systems.items()},
+            "largest": sorted(self.calls, key=lambda call: -call["prompt_tokens"])[:TOP_PROMPTS],
+        }
+
+    def load(self, path, keep=None):
+        # adds the calls of an earlier run's usage file, so a resumed run reports (and budgets) the
+        # spend of the whole job rather than only its own calls; keep(call) picks a subset
+        self.add(call for call in read_calls(path) if keep is None or keep(call))
+
+    def add(self, calls):
+        calls = list(calls)
+        self.calls.extend(calls)
+        self.spent += sum(call.get("cost") or 0.0 for call in calls)
+
+    def write(self, path):
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({**self.summary(), "calls": self.calls}, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def format_summary(self):
+        run = self.summary()["run"]
+        cost = f", ${run['cost']:.4f}" if run["cost"] is not None else ""
+        return f"Usage: {run['calls']} calls, {run['prompt_tokens']} prompt + {run['completion_tokens']} completion tokens{cost}"
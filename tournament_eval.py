@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+import jsonlines
+from openai import AsyncOpenAI
+
+from batch_customized_eval import (
+    CONCURRENCY,
+    MAX_TOKENS,
+    MODEL,
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    TokenBucketLimiter,
+    abatch_eval,
+    build_messages,
+    input_hash,
+    usage_path,
+)
+from dataset_io import load_columns, system_name
+from token_usage import UsageTracker, format_preflight, preflight, truncate_text
+
+CRITERIA = ["Accuracy", "Comprehensiveness", "Diversity", "Empowerment", "Hallucination", "Overall Winner"]
+
+DEFAULT_CACHE_FILE = "judgments.jsonl"
+
+
+def load_responses(path):
+    # a failed answer (an empty response, see pipeline.failed_row) is left out instead of being judged
+    data = load_columns(path, ["user_input", "response"])
+    return {question: response for question, response in zip(data["user_input"], data["response"]) if response}
+
+
+def load_judgments(cache_file):
+    # content hash of (model, question, answer 1, answer 2) -> evaluation
+    judgments = {}
+    if not os.path.exists(cache_file):
+        return judgments
+    with open(cache_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            judgments[record["input_hash"]] = record["evaluation"]
+    return judgments
+
+
+def winner_of(evaluation, criterion):
+    winner = str(evaluation.get(criterion, {}).get("Winner", ""))
+    if "Answer 1" in winner:
+        return 0
+    if "Answer 2" in winner:
+        return 1
+    return None
+
+
+def build_comparisons(systems, responses, model=MODEL):
+    # every pair in both orderings, so each system appears as Answer 1 and as Answer 2
+    questions = [q for q in responses[systems[0]] if all(q in responses[s] for s in systems[1:])]
+    comparisons = []
+    for question in questions:
+        for first, second in itertools.permutations(systems, 2):
+            answer1 = responses[first][question]
+            answer2 = responses[second][question]
+            comparisons.append({
+                "question": question,
+                "systems": (first, second),
+                "item": (question, answer1, answer2),
+                "input_hash": input_hash(model, question, answer1, answer2),
+            })
+    return questions, comparisons
+
+
+def win_matrix(systems, comparisons, judgments):
+    # matrix[criterion][a][b] = number of judgments where a beat b
+    matrix = {c: {a: {b: 0 for b in systems if b != a} for a in systems} for c in CRITERIA}
+    for comparison in comparisons:
+        evaluation = judgments.get(comparison["input_hash"])
+        if evaluation is None:
+            continue
+        for criterion in CRITERIA:
+            winner = winner_of(evaluation, criterion)
+            if winner is None:
+                continue
+            a, b = comparison["systems"] if winner == 0 else comparison["systems"][::-1]
+            matrix[criterion][a][b] += 1
+    return matrix
+
+
+def win_rates(matrix):
+    rates = {}
+    for a, row in matrix.items():
+        wins = sum(row.values())
+        total = sum(row[b] + matrix[b][a] for b in row)
+        rates[a] = wins / total if total else 0.0
+    return rates
+
+
+def tournament_eval(dataset_files, output_file_path, cache_file=DEFAULT_CACHE_FILE, api_key=None, base_url=None,
+                    rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE, concurrency=CONCURRENCY, model=MODEL,
+                    max_tokens=MAX_TOKENS, budget=None, max_answer_tokens=None, preflight_only=False):
+    systems = [system_name(path) for path in dataset_files]
+    if len(set(systems)) != len(systems) or len(systems) < 2:
+        print("Warning: need at least two dataset files with distinct system names, please check!")
+        return
+    responses = {name: load_responses(path) for name, path in zip(systems, dataset_files)}
+    if max_answer_tokens:
+        # before hashing, so cached judgments are only reused for the same truncated prompt
+        responses = {
+            name: {q: truncate_text(answer, max_answer_tokens, model) for q, answer in answers.items()}
+            for name, answers in responses.items()
+        }
+    questions, comparisons = build_comparisons(systems, responses, model)
+
+    # only comparisons whose exact (question, answer 1, answer 2) were never judged cost a call
+    judgments = load_judgments(cache_file)
+    pending = list({c["input_hash"]: c for c in comparisons if c["input_hash"] not in judgments}.values())
+    print(f"{len(questions)} questions, {len(comparisons)} comparisons, {len(pending)} to judge")
+    estimate = preflight(
+        [(" vs ".join(c["systems"]) + f": {c['question'][:40]}", build_messages(*c["item"])) for c in pending],
+        model, max_tokens, rpm, tpm,
+    )
+    print(format_preflight(estimate))
+    if preflight_only:
+        return estimate
+
+    # an earlier result for this output means a resumed job, its recorded spend carries over
+    usage = UsageTracker(model, budget)
+    if os.path.exists(output_file_path):
+        usage.load(usage_path(output_file_path))
+    if pending:
+        client = AsyncOpenAI(
+            api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+            base_url=base_url or os.environ.get("OPENAI_BASE_URL"),
+            max_retries=0,
+        )
+        with jsonlines.open(cache_file, mode="a", flush=True) as writer:
+            def on_result(index, evaluation):
+                comparison = pending[index]
+                judgments[comparison["input_hash"]] = evaluation
+                writer.write({
+                    "input_hash": comparison["input_hash"],
+                    "question": comparison["question"],
+                    "systems": list(comparison["systems"]),
+                    "evaluation": evaluation,
+                })
+
+            limiter = TokenBucketLimiter(rpm, tpm)
+            try:
+                asyncio.run(abatch_eval(
+                    [c["item"] for c in pending], client, limiter, concurrency, model, max_tokens, on_result=on_result,
+                    usage=usage, labels=[{"systems": list(c["systems"])} for c in pending],
+                ))
+            finally:
+                usage.write(usage_path(output_file_path))
+        print(usage.format_summary())
+
+    matrix = win_matrix(systems, comparisons, judgments)
+    result = {
+        "systems": systems,
+        "questions": len(questions),
+        "comparisons": len(comparisons),
+        "judged": sum(c["input_hash"] in judgments for c in comparisons),
+        "win_matrix": matrix,
+        "win_rate": {criterion: win_rates(matrix[criterion]) for criterion in CRITERIA},
+        "usage": usage.summary(),
+    }
+    with open(output_file_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    overall = matrix["Overall Winner"]
+    print("Overall wins (row beat column):")
+    print("\t".join([""] + systems))
+    for a in systems:
+        print("\t".join([a] + ["-" if a == b else str(overall[a][b]) for b in systems]))
+    print(f"Tournament results are written to {output_file_path}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pairwise judge every system against every other")
+    parser.add_argument("datasets", nargs="+", help="dataset_*.json or .parquet files, one per system")
+    parser.add_argument("--output", default="tournament_results.json")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="judgment cache shared between runs")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE)
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="completion tokens allowed per judgment")
+    parser.add_argument("--budget", type=float, default=None, help="stop sending once this much USD could be spent")
+    parser.add_argument("--max-answer-tokens", type=int, default=None, help="truncate longer answers before judging")
+    parser.add_argument("--preflight", action="store_true", help="only print the local token and cost estimate")
+    args = parser.parse_args()
+
+    tournament_eval(args.datasets, args.output, args.cache, rpm=args.rpm, tpm=args.tpm,
+                    concurrency=args.concurrency, model=args.model, max_tokens=args.max_tokens, budget=args.budget,
+                    max_answer_tokens=args.max_answer_tokens, preflight_only=args.preflight)
@@ -0,0 +1,156 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+DEFAULT_TRACE_PATH = os.path.join(".cache", "traces.jsonl")
+
+# span attributes that are summed in summaries when a stage reports them
+TOKEN_FIELDS = ["llm_calls", "prompt_tokens", "output_tokens"]
+
+# the trace spans are recorded into; copied into asyncio tasks and the stream thread's loop
+_current = contextvars.ContextVar("trace", default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    # Timing spans of one query. Span start offsets are relative to the trace start, so a
+    # trace can be replayed as a timeline; spans may close on other threads.
+
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, attrs):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self._origin) * 1000, 3),
+                "duration_ms": round((end - start) * 1000, 3),
+                "thread": threading.current_thread().name,
+                **({"attrs": attrs} if attrs else {}),
+            })
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._origin) * 1000, 3)
+
+    def to_record(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item["start_ms"])
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            "spans": spans,
+        }
+
+
+@contextmanager
+def trace(name, **attrs):
+    current = Trace(name, **attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        current.finish()
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, **attrs):
+    # times the block into the current trace, a no-op outside of one; the yielded dict
+    # takes attributes only known at the end, such as token counts
+    current = _current.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        if current is not None:
+            current.add(name, start, time.perf_counter(), attrs)
+
+
+def write_traces(traces, path=DEFAULT_TRACE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _write_lock, open(path, "a", encoding="utf-8") as f:
+        for item in traces:
+            f.write(json.dumps(item.to_record(), default=str) + "\n")
+
+
+def load_traces(path=DEFAULT_TRACE_PATH, limit=None):
+    # trace records from the JSONL file, the most recent `limit` ones
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records[-limit:] if limit else records
+
+
+def to_chrome_trace(records):
+    # chrome://tracing / Perfetto format, one timeline row per query
+    events = []
+    for row, record in enumerate(records, start=1):
+        origin = record["started"] * 1e6
+        label = record["attrs"].get("question") or record["name"]
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": row, "args": {"name": str(label)[:80]}})
+        events.append({
+            "name": record["name"], "ph": "X", "pid": 1, "tid": row,
+            "ts": origin, "dur": (record["duration_ms"] or 0) * 1000, "args": record["attrs"],
+        })
+        for item in record["spans"]:
+            events.append({
+                "name": item["name"], "ph": "X", "pid": 1, "tid": row,
+                "ts": origin + item["start_ms"] * 1000, "dur": item["duration_ms"] * 1000,
+                "args": item.get("attrs", {}),
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(records, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(records), f, default=str)
+
+
+def summarize(records):
+    # per-stage count and p50/p95 wall time in ms, plus token totals where stages report them
+    rows = []
+    for record in records:
+        rows.append({"stage": record["name"], "duration_ms": record["duration_ms"]})
+        for item in record["spans"]:
+            attrs = item.get("attrs", {})
+            rows.append({
+                "stage": item["name"],
+                "duration_ms": item["duration_ms"],
+                **{field: attrs[field] for field in TOKEN_FIELDS if field in attrs},
+            })
+    if not rows:
+        return pd.DataFrame(columns=["count", "p50_ms", "p95_ms"])
+    df = pd.DataFrame(rows)
+    durations = df.groupby("stage", sort=False)["duration_ms"]
+    summary = pd.DataFrame({
+        "count": durations.count(),
+        "p50_ms": durations.quantile(0.5),
+        "p95_ms": durations.quantile(0.95),
+    })
+    for field in TOKEN_FIELDS:
+        if field in df:
+            summary[field] = df.groupby("stage", sort=False)[field].sum(min_count=1)
+    return summary.round(1).sort_values("p50_ms", ascending=False)